@@ -1,17 +1,115 @@
-import os
+import hmac
+import time
 import uuid
 
-from flask import Flask, abort, jsonify, send_from_directory, request
+from flask import Flask, Response, abort, jsonify, request
 from flask_sock import Sock
+from simple_websocket import ConnectionClosed
 
+from archive import GameArchive
+from binary_protocol import SUBPROTOCOL
 from connection_handler import GameConnectionHandler
 from db_handler import DBHandler
+from hints import HintService
+from matchmaking import Matchmaker
+from metrics import REGISTRY, counter, gauge
+from observers import ObserverQueue
+from profiling import sample_stacks, collapsed, start_trace, stop_trace, TRACES
+from rate_limit import RateLimiter, TokenBucket
+from static_assets import AssetManifest
 
 app = Flask(__name__, static_folder='build')
+# Clients can opt in to the binary protocol by requesting its WebSocket subprotocol
+app.config['SOCK_SERVER_OPTIONS'] = {'subprotocols': [SUBPROTOCOL]}
+# Messages per second and burst allowed for each connection and for each ip address
+app.config['CONNECTION_MESSAGE_RATE'] = (5, 10)
+app.config['IP_MESSAGE_RATE'] = (20, 40)
+# Token required by the /admin endpoints in the Authorization header, they are disabled without it
+app.config['ADMIN_TOKEN'] = None
+# Directory of the databases of the archived games, see archive.py
+app.config['ARCHIVE_DIRECTORY'] = 'archive'
+# Positions searched for a hint by default and at most, and hints kept in memory
+app.config['HINT_BUDGET'] = 5000
+app.config['HINT_MAX_BUDGET'] = 50000
+app.config['HINT_CACHE_SIZE'] = 4096
+# Settings can be overridden with FLASK_ prefixed environment variables,
+# eg: FLASK_IP_MESSAGE_RATE='[1000, 2000]'
+app.config.from_prefixed_env()
 sock = Sock(app)
 
-game_connection_handler = GameConnectionHandler(app.logger)
-db_handler = DBHandler()
+game_connection_handler = GameConnectionHandler(app.logger, pool_size=64)
+# Moves are saved by the worker of a queue, so players don't wait for the database
+db_handler = DBHandler(queue=ObserverQueue('db'), archive=GameArchive(app.config['ARCHIVE_DIRECTORY']))
+matchmaker = Matchmaker(game_connection_handler, db_handler, logger=app.logger)
+ip_rate_limiter = RateLimiter(*app.config['IP_MESSAGE_RATE'])
+hint_service = HintService(app.config['HINT_CACHE_SIZE'])
+# The frontend build is indexed once, restart the server after updating it
+assets = AssetManifest(app.static_folder)
+
+gauge('sidestacker_games', 'Games that are not over').set_function(
+    lambda: sum(1 for g in list(game_connection_handler.games.values()) if not g['game'].is_over))
+gauge('sidestacker_connections', 'Connected players and bots').set_function(
+    lambda: sum(len(g['players']) for g in list(game_connection_handler.games.values())))
+THROTTLED_MESSAGES = counter('sidestacker_throttled_messages_total', 'Client messages delayed or refused', ['reason'])
+_connection_rate = THROTTLED_MESSAGES.labels('connection_rate')
+_ip_rate = THROTTLED_MESSAGES.labels('ip_rate')
+_hint_rate = THROTTLED_MESSAGES.labels('hint_rate')
+
+
+@app.before_request
+def start_matchmaker():
+    # Threads aren't started on import, as the pre-fork server imports the app before forking
+    if not matchmaker.started:
+        matchmaker.start()
+
+
+@app.route('/metrics')
+def metrics():
+    return Response(REGISTRY.expose(), mimetype='text/plain; version=0.0.4')
+
+
+def require_admin():
+    token = app.config['ADMIN_TOKEN']
+    if not token:
+        abort(404)
+    # Compared in constant time, so the response time doesn't reveal the token
+    if not hmac.compare_digest(request.headers.get('Authorization', '').encode(), ('Bearer %s' % token).encode()):
+        abort(401)
+
+
+@app.route('/admin/profile')
+def admin_profile():
+    """
+    Sample the stacks of every thread for the given seconds.
+    Returns the stacks in the collapsed format used by flame graph tools.
+    """
+    require_admin()
+    seconds = min(request.args.get('seconds', 10, type=float), 120)
+    interval = max(request.args.get('interval', 0.005, type=float), 0.001)
+    stacks = sample_stacks(seconds, interval)
+    if stacks is None:
+        return abort(409, 'A profile is already running')
+    return Response(collapsed(stacks), mimetype='text/plain')
+
+
+@app.route('/admin/trace/<game_id>', methods=['POST', 'GET', 'DELETE'])
+def admin_trace(game_id):
+    """
+    Start (POST), read (GET) or stop and read (DELETE) the trace of a game.
+    """
+    require_admin()
+    if request.method == 'POST':
+        if not game_connection_handler.has_game(game_id):
+            return abort(404, 'Game not found')
+        trace = start_trace(game_id, request.args.get('max_spans', 10000, type=int))
+    elif request.method == 'GET':
+        trace = TRACES.get(game_id)
+    else:
+        trace = stop_trace(game_id)
+
+    if trace is None:
+        return abort(404, 'Game not traced')
+    return jsonify(trace.to_dict())
 
 
 @app.route('/api/new-game', methods=['POST'])
@@ -25,30 +123,158 @@ def new_game():
     return jsonify({'game_id': game_id})
 
 
+@app.route('/api/matchmaking', methods=['POST'])
+def matchmaking():
+    """
+    Wait for another player and return the game both players should connect to.
+    """
+    timeout = request.args.get('timeout', 30, type=float)
+    ticket = matchmaker.request_match()
+    game_id = ticket.wait(min(timeout, 60))
+    if game_id is None and matchmaker.cancel(ticket):
+        return abort(408, 'No match found')
+
+    return jsonify({'game_id': ticket.game_id})
+
+
 @sock.route('/api/game/<game_id>')
 def game_endpoint(ws, game_id):
     if game_id is None or not game_connection_handler.has_game(game_id):
         return jsonify(abort(404, 'Game not found'))
 
-    player_id = str(uuid.uuid4()).split('-')[-1]
+    binary = ws.subprotocol == SUBPROTOCOL
+    # A player that lost its connection can reconnect with its player id
+    # and the last turn it received
+    player_id = request.args.get('player_id')
     try:
-        game_connection_handler.add_connection(game_id, ws, player_id)
+        if player_id is None:
+            player_id = str(uuid.uuid4()).split('-')[-1]
+            game_connection_handler.add_connection(game_id, ws, player_id, binary=binary)
+        else:
+            last_turn = request.args.get('last_turn', type=int)
+            game_connection_handler.reconnect(game_id, ws, player_id, last_turn, binary=binary)
     except ValueError:
         return jsonify(abort(404, 'Game not found'))
 
+    # Connections over their rate or the rate of their ip address are delayed, which stops
+    # reading from the socket and pushes back on the client.
+    connection_bucket = TokenBucket(*app.config['CONNECTION_MESSAGE_RATE'])
+    ip = request.remote_addr
     while True:
         try:
             data = ws.receive()
+            if not connection_bucket.consume():
+                _connection_rate.inc()
+                time.sleep(connection_bucket.wait_time())
+                connection_bucket.consume()
+            if not ip_rate_limiter.consume(ip):
+                _ip_rate.inc()
+                # Other connections of the address compete for its tokens
+                while not ip_rate_limiter.consume(ip):
+                    time.sleep(ip_rate_limiter.wait_time(ip))
             game_connection_handler.handle_client_message(game_id, player_id, data)
-        except ConnectionError:
-            app.logger.warning('[gId: %s][pId: %s] A player disconnected')
+        except (ConnectionError, ConnectionClosed):
+            app.logger.warning('[gId: %s][pId: %s] A player disconnected' % (game_id, player_id))
+            game_connection_handler.close_connection(game_id, player_id)
+            break
+        except Exception:
+            # The player can still reconnect, instead of being left in the game without a connection
+            app.logger.exception('[gId: %s][pId: %s] Unable to handle a message' % (game_id, player_id))
             game_connection_handler.close_connection(game_id, player_id)
+            raise
+
+
+@app.route('/api/game/<game_id>/state')
+def game_state(game_id):
+    """
+    Returns a snapshot of the game.
+    The snapshot version is used as its ETag, so clients can poll it with `If-None-Match`.
+    """
+    try:
+        game = game_connection_handler.get_game(game_id)
+    except ValueError:
+        return abort(404, 'Game not found')
+
+    # The version is read from the snapshot, so the ETag matches the state that is sent
+    snapshot = game.snapshot()
+    etag = '%s-%d' % (game.id, snapshot['version'])
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = jsonify(snapshot)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+@app.route('/api/game/<game_id>/history')
+def game_history(game_id):
+    """
+    Returns a saved game with its moves, archived games included.
+    """
+    game = db_handler.get_game(game_id)
+    if game is None:
+        return abort(404, 'Game not found')
+
+    moves = [dict(row=row, side=side, player=piece, turn=turn) for (row, side, piece, turn) in game['moves']]
+    return jsonify(dict(game, moves=moves))
+
+
+@app.route('/api/game/<game_id>/hint')
+def game_hint(game_id):
+    """
+    Returns the best move found for the player of the turn, and its score between -1 and 1.
+    The amount of positions searched can be set with `budget`, up to HINT_MAX_BUDGET.
+
+    Hints are limited by the ip rate, a request costs a message per HINT_BUDGET positions.
+    """
+    try:
+        game = game_connection_handler.get_game(game_id)
+    except ValueError:
+        return abort(404, 'Game not found')
+
+    budget = request.args.get('budget', app.config['HINT_BUDGET'], type=int)
+    if budget is None or not 0 < budget <= app.config['HINT_MAX_BUDGET']:
+        return abort(400, 'Invalid budget')
+
+    tokens = -(-budget // app.config['HINT_BUDGET'])
+    if not ip_rate_limiter.consume(request.remote_addr, tokens):
+        _hint_rate.inc()
+        return abort(429, 'Too many hint requests')
+
+    view = game.view()
+    if view.is_over or view.player_turn is None:
+        return abort(409, 'The game is not being played')
+
+    hint = hint_service.hint(view, budget)
+    response = jsonify(dict(hint, turn=view.turn, player_turn=view.player_turn))
+    # The hint may come from the search of a larger budget, the depth identifies the result
+    response.set_etag('%s-%d-%d' % (game.id, view.version, hint['depth']))
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+@sock.route('/api/game/<game_id>/spectate')
+def spectate_endpoint(ws, game_id):
+    policy = request.args.get('policy', 'coalesce')
+    try:
+        spectator = game_connection_handler.add_spectator(game_id, policy)
+    except ValueError:
+        return jsonify(abort(404, 'Game not found'))
+
+    try:
+        while ws.connected and not spectator.closed:
+            message = spectator.next_message(timeout=5)
+            if message is not None:
+                ws.send(message)
+    finally:
+        spectator.close()
 
 
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
 def serve(path):
-    if path != "" and os.path.exists(app.static_folder + '/' + path):
-        return send_from_directory(app.static_folder, path)
-    else:
-        return send_from_directory(app.static_folder, 'index.html')
+    asset = (path != "" and assets.get(path)) or assets.get('index.html')
+    if asset is None:
+        return abort(404)
+    return assets.response(asset, request)
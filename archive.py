@@ -0,0 +1,156 @@
+"""
+Archival of old games out of the database the server writes to.
+
+Finished games older than a threshold are moved from the hot database to an archive file per
+period (eg: games-2024-05.sqlite for a month), so the hot database only holds the recent and
+live games and its writes don't slow down as the history grows. Games that never finished,
+eg: the games of a server that was restarted, are moved once they're older than the threshold
+and `ABANDONED_AFTER`. Games are moved in transactions of up to `batch_size` games, a game is
+either in the hot database or in its archive.
+
+Reads through `DBHandler.get_game`, eg: the /api/game/<game_id>/history endpoint, attach the
+archive files, newest first, when a game isn't in the hot database.
+
+Usage:
+    python archive.py --db db.sqlite --directory archive --older-than-days 30
+    python archive.py --db db.sqlite --directory archive --older-than-days 365 --period year --vacuum
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+from sqlite3 import Connection
+from typing import Dict, List, Optional
+
+from db_handler import BUSY_TIMEOUT, DBHandler, read_game
+
+# strftime formats of the periods of the archive files
+PERIODS = {
+    'day': '%Y-%m-%d',
+    'month': '%Y-%m',
+    'year': '%Y'
+}
+# Condition of the games to archive, given the cutoffs of the finished and the abandoned games
+ARCHIVABLE = '(winner is not null and game_start < ?) or game_start < ?'
+# Age after which a game that isn't over is considered abandoned
+ABANDONED_AFTER = timedelta(days=1)
+
+
+class GameArchive:
+    """
+    A directory of archive databases, one per period of `period_format` of the games start.
+    """
+
+    def __init__(self, directory: str, period_format=PERIODS['month']):
+        self.directory = directory
+        self.period_format = period_format
+
+    def path(self, period: str) -> str:
+        return os.path.join(self.directory, 'games-%s.sqlite' % period)
+
+    def files(self) -> List[str]:
+        """
+        The archive files, newest period first.
+        """
+        return sorted(glob.glob(os.path.join(self.directory, 'games-*.sqlite')), reverse=True)
+
+    def archive_games(self, hot_file: str, older_than: timedelta, now: Optional[datetime] = None,
+                      vacuum=False, batch_size=500) -> Dict[str, int]:
+        """
+        Move the games started before `older_than` from the hot database to the archive, games
+        that aren't over are only moved once they're also older than `ABANDONED_AFTER`.
+        Returns the amount of games moved to each period.
+
+        Writes to the hot database wait while a batch is moved, `batch_size` bounds that time.
+        """
+        now = now or datetime.utcnow()
+        cutoffs = ((now - older_than).strftime('%Y-%m-%d %H:%M:%S'),
+                   (now - max(older_than, ABANDONED_AFTER)).strftime('%Y-%m-%d %H:%M:%S'))
+        os.makedirs(self.directory, exist_ok=True)
+        # Transactions are handled explicitly as databases can't be attached within one
+        con = Connection(hot_file, timeout=BUSY_TIMEOUT, isolation_level=None)
+        moved = {}
+        try:
+            periods = [row[0] for row in con.execute(
+                'select distinct strftime(?, game_start) from game where ' + ARCHIVABLE,
+                (self.period_format,) + cutoffs)]
+            for period in periods:
+                moved[period] = self._move_period(con, period, cutoffs, batch_size)
+            if vacuum and moved:
+                con.execute('vacuum')
+        finally:
+            con.close()
+        return moved
+
+    def find_game(self, con: Connection, game_id) -> Optional[dict]:
+        """
+        Look up a game in the archive files through the given connection.
+        """
+        for path in self.files():
+            con.execute('attach database ? as archive', (path,))
+            try:
+                game = read_game(con, game_id, 'archive')
+            finally:
+                con.execute('detach database archive')
+            if game is not None:
+                return game
+        return None
+
+    def _move_period(self, con: Connection, period: str, cutoffs, batch_size: int) -> int:
+        path = self.path(period)
+        # Creates the tables of the archive file
+        DBHandler(path).initialize()
+        con.execute('attach database ? as archive', (path,))
+        total = 0
+        try:
+            while True:
+                count = self._move_batch(con, period, cutoffs, batch_size)
+                total += count
+                if count < batch_size:
+                    return total
+        finally:
+            con.execute('detach database archive')
+
+    def _move_batch(self, con: Connection, period: str, cutoffs, batch_size: int) -> int:
+        con.execute('begin immediate')
+        try:
+            con.execute('create temp table archived as select game_id from main.game '
+                        'where (' + ARCHIVABLE + ') and strftime(?, game_start) = ? limit ?',
+                        cutoffs + (self.period_format, period, batch_size))
+            con.execute('insert into archive.game (game_id, winner, game_start) '
+                        'select game_id, winner, game_start from main.game '
+                        'where game_id in (select game_id from temp.archived)')
+            con.execute('insert into archive.game_moves (game_id, row, side, piece, turn) '
+                        'select game_id, row, side, piece, turn from main.game_moves '
+                        'where game_id in (select game_id from temp.archived)')
+            con.execute('delete from main.game_moves where game_id in (select game_id from temp.archived)')
+            count = con.execute('delete from main.game where game_id in (select game_id from temp.archived)').rowcount
+            con.execute('drop table temp.archived')
+            con.execute('commit')
+        except Exception:
+            con.execute('rollback')
+            raise
+        return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Move old sidestacker games to archive databases')
+    parser.add_argument('--db', default='db.sqlite', help='The database the server writes to')
+    parser.add_argument('--directory', default='archive', help='Directory of the archive databases')
+    parser.add_argument('--older-than-days', type=float, default=30)
+    parser.add_argument('--period', choices=PERIODS, default='month', help='Period of each archive database')
+    parser.add_argument('--vacuum', action='store_true', help='Reclaim the space of the hot database')
+    parser.add_argument('--batch-size', type=int, default=500, help='Games moved per transaction')
+    args = parser.parse_args(argv)
+
+    archive = GameArchive(args.directory, PERIODS[args.period])
+    moved = archive.archive_games(args.db, timedelta(days=args.older_than_days), vacuum=args.vacuum,
+                                   batch_size=args.batch_size)
+    print(json.dumps(moved, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,298 @@
+"""
+Micro and macro benchmarks of the game engine and server components.
+
+Each benchmark is timed by running its operation in batches and reporting the time per
+operation of the fastest and the median batch. Results are written as JSON, and can be
+compared against a stored baseline to detect regressions.
+
+Usage:
+    python benchmark.py --output bench.json
+    python benchmark.py --save-baseline bench-baseline.json
+    python benchmark.py --baseline bench-baseline.json --threshold 0.1 --threshold db_add_move=0.5
+
+The exit code is 1 when a benchmark is slower than its baseline by more than its threshold.
+"""
+import argparse
+import inspect
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, Dict
+
+from bot import Bot
+from connection_handler import GameConnectionHandler
+from db_handler import DBHandler
+from sidestacker import SideStacker, evaluate_move, is_move_legal, get_next_free_position
+
+BENCHMARKS = {}
+
+
+def benchmark(name: str, number=1000):
+    """
+    Register a benchmark.
+    The decorated function is the setup of the benchmark, it should return the operation to be timed.
+    Setups with resources to clean up can yield the operation instead, they're resumed once the
+    benchmark is done.
+    """
+    def decorator(setup: Callable[[], Callable[[], None]]):
+        BENCHMARKS[name] = (setup, number)
+        return setup
+    return decorator
+
+
+def random_board(pieces=20, seed=0):
+    rnd = random.Random(seed)
+    board = [[None] * 7 for _ in range(7)]
+    for _ in range(pieces):
+        row = rnd.randrange(7)
+        side = rnd.choice('LR')
+        col = get_next_free_position(board, row, side)
+        if col is not None:
+            board[row][col] = rnd.choice('XC')
+    return board
+
+
+def new_bot_game(seed=None) -> SideStacker:
+    """
+    Creates a game between two bots, the game is played as soon as the second bot connects.
+    """
+    ss = SideStacker(str(seed))
+    for player_id in ('a', 'b'):
+        bot = Bot(ss, player_id, start_delay=0)
+        bot.observe()
+    return ss
+
+
+class FakeWebSocket:
+    def send(self, data):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeGame:
+    def place_piece(self, player_id, row, side):
+        pass
+
+
+@benchmark('evaluate_move', number=20000)
+def bench_evaluate_move():
+    board = random_board()
+    return lambda: evaluate_move(board, 3, 3, 'X')
+
+
+@benchmark('is_move_legal', number=50000)
+def bench_is_move_legal():
+    board = random_board()
+    return lambda: is_move_legal(board, 3, 'R')
+
+
+@benchmark('get_next_free_position', number=50000)
+def bench_get_next_free_position():
+    board = random_board()
+    return lambda: get_next_free_position(board, 3, 'L')
+
+
+@benchmark('sidestacker_place_piece', number=5000)
+def bench_place_piece():
+    moves = []
+    state = {}
+
+    def new_game():
+        ss = SideStacker('bench')
+        ss.connect('a')
+        ss.connect('b')
+        state['game'] = ss
+        moves.clear()
+        moves.extend((row, side) for row in range(7) for side in 'LR' for _ in range(3))
+        random.Random(0).shuffle(moves)
+
+    def place_piece():
+        ss = state['game']
+        if ss.is_over or not moves:
+            new_game()
+            ss = state['game']
+        player_id = 'a' if ss.players['a'][0] == ss.player_turn else 'b'
+        (row, side) = moves.pop()
+        ss.place_piece(player_id, row, side)
+
+    new_game()
+    return place_piece
+
+
+@benchmark('bot_do_move', number=2000)
+def bench_bot_do_move():
+    bot = Bot(FakeGame(), 'a', random_board())
+    bot.player_piece = 'X'
+    return bot.do_move
+
+
+@benchmark('bot_vs_bot_game', number=50)
+def bench_bot_vs_bot_game():
+    def play():
+        ss = new_bot_game()
+        ss.connect('a')
+        ss.connect('b')
+    return play
+
+
+@benchmark('connection_handler_fan_out', number=5000)
+def bench_fan_out():
+    gch = GameConnectionHandler()
+    state = {}
+
+    def new_game():
+        game = gch.new_game()
+        gch.add_connection(game.id, FakeWebSocket(), 'a')
+        gch.add_connection(game.id, FakeWebSocket(), 'b')
+        for _ in range(10):
+            gch.add_spectator(game.id)
+        state['game'] = game
+
+    def place_piece():
+        ss = state['game']
+        if ss.is_over or ss.turn > 40:
+            del gch.games[ss.id]
+            new_game()
+            ss = state['game']
+        player_id = 'a' if ss.players['a'][0] == ss.player_turn else 'b'
+        ss.place_piece(player_id, ss.turn % 7, 'L' if ss.turn % 14 < 7 else 'R')
+
+    new_game()
+    return place_piece
+
+
+@benchmark('db_add_move', number=200)
+def bench_db_add_move():
+    with tempfile.TemporaryDirectory() as directory:
+        db = DBHandler(os.path.join(directory, 'bench.sqlite'))
+        db.create_game('bench')
+        yield lambda: db.add_move('bench', 3, 'L', 'X', 0)
+
+
+def run_benchmark(setup, number, repeat=5) -> Dict[str, float]:
+    operation = setup()
+    generator = None
+    if inspect.isgenerator(operation):
+        generator = operation
+        operation = next(generator)
+
+    try:
+        # Warm up
+        for _ in range(max(1, number // 10)):
+            operation()
+
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter_ns()
+            for _ in range(number):
+                operation()
+            timings.append((time.perf_counter_ns() - start) / number)
+    finally:
+        if generator is not None:
+            next(generator, None)
+
+    return {
+        'ns_per_op_min': min(timings),
+        'ns_per_op_median': statistics.median(timings),
+        'number': number,
+        'repeat': repeat
+    }
+
+
+def run(names, scale=1.0, repeat=5) -> dict:
+    results = {}
+    for name in names:
+        (setup, number) = BENCHMARKS[name]
+        results[name] = run_benchmark(setup, max(1, int(number * scale)), repeat)
+        print('%-30s %12.0f ns/op' % (name, results[name]['ns_per_op_median']), file=sys.stderr)
+
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'timestamp': time.time()
+        },
+        'results': results
+    }
+
+
+def compare(current: dict, baseline: dict, default_threshold: float, thresholds: Dict[str, float]) -> list:
+    """
+    Compare the results against a baseline.
+    Returns a list of (name, baseline ns/op, current ns/op, ratio) of the regressed benchmarks.
+    """
+    regressions = []
+    for (name, result) in current['results'].items():
+        if name not in baseline['results']:
+            continue
+        base = baseline['results'][name]['ns_per_op_median']
+        ratio = result['ns_per_op_median'] / base
+        if ratio > 1 + thresholds.get(name, default_threshold):
+            regressions.append((name, base, result['ns_per_op_median'], ratio))
+    return regressions
+
+
+def parse_thresholds(values):
+    default = 0.1
+    thresholds = {}
+    for value in values:
+        if '=' in value:
+            (name, threshold) = value.split('=', 1)
+            thresholds[name] = float(threshold)
+        else:
+            default = float(value)
+    return default, thresholds
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the sidestacker benchmarks')
+    parser.add_argument('benchmarks', nargs='*', help='Benchmarks to run, defaults to all of them')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    parser.add_argument('--baseline', help='Compare the results against this baseline')
+    parser.add_argument('--save-baseline', help='Write the results as the new baseline')
+    parser.add_argument('--threshold', action='append', default=[],
+                        help='Allowed slowdown as a fraction, eg: 0.1 or name=0.5 for a single benchmark')
+    parser.add_argument('--scale', type=float, default=1.0, help='Multiplier of the operations per benchmark')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--list', action='store_true', help='List the benchmarks')
+    args = parser.parse_args(argv)
+
+    if args.list:
+        print('\n'.join(BENCHMARKS))
+        return 0
+
+    names = args.benchmarks or list(BENCHMARKS)
+    unknown = [n for n in names if n not in BENCHMARKS]
+    if unknown:
+        parser.error('Unknown benchmarks: %s' % ', '.join(unknown))
+
+    results = run(names, args.scale, args.repeat)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        (default, thresholds) = parse_thresholds(args.threshold)
+        regressions = compare(results, baseline, default, thresholds)
+        for (name, base, current, ratio) in regressions:
+            print('REGRESSION %s: %.0f ns/op -> %.0f ns/op (%.2fx)' % (name, base, current, ratio))
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
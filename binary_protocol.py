@@ -0,0 +1,105 @@
+"""
+Compact binary encoding of the game messages.
+
+This is an opt-in alternative to the JSON messages, negotiated with the WebSocket
+subprotocol `SUBPROTOCOL`. Every message starts with a byte identifying its type,
+followed by a fixed layout of single byte fields:
+
+    Client messages:
+        piece-placement:    type, row << 1 | side
+
+    Server messages:
+        connection:         type, piece, turn order, player id (ascii, rest of the message)
+        disconnection:      type, piece
+        player_info:        type, player count, (piece, turn order) for each player
+        game_over:          type, winner
+        piece_placed:       type, piece, row << 1 | side, turn
+        piece_placed_error: type, turn
+        snapshot:           type, turn, player turn, is over, winner, 49 board pieces (row by row)
+
+Pieces are encoded as 0 for no piece (eg: a tie), 1 for 'X' and 2 for 'C'.
+Sides are encoded as 0 for 'L' and 1 for 'R'.
+"""
+from struct import Struct
+from typing import Tuple
+
+from events import *
+
+SUBPROTOCOL = 'sidestacker.bin.v1'
+
+PIECE_PLACEMENT = 0x01
+
+CONNECTION = 0x10
+DISCONNECTION = 0x11
+PLAYER_INFO = 0x12
+GAME_OVER = 0x13
+PIECE_PLACED = 0x14
+PIECE_PLACED_ERROR = 0x15
+SNAPSHOT = 0x16
+
+PIECES = {None: 0, 'X': 1, 'C': 2}
+SIDES = {'L': 0, 'R': 1}
+SIDES_BY_CODE = ('L', 'R')
+
+_two_bytes = Struct('BB')
+_three_bytes = Struct('BBB')
+_four_bytes = Struct('BBBB')
+_five_bytes = Struct('BBBBB')
+
+
+def decode_piece_placement(data: bytes) -> Tuple[int, Literal['L', 'R']]:
+    """
+    Decode a piece-placement client message into its row and side.
+    Raises ValueError if the message is malformed.
+    """
+    if len(data) != 2 or data[0] != PIECE_PLACEMENT:
+        raise ValueError('Invalid piece-placement message')
+    position = data[1]
+    if position >> 1 >= 7:
+        raise ValueError('Invalid row in piece-placement message')
+    return position >> 1, SIDES_BY_CODE[position & 1]
+
+
+def encode_piece_placement(row: int, side: Literal['L', 'R']) -> bytes:
+    return _two_bytes.pack(PIECE_PLACEMENT, row << 1 | SIDES[side])
+
+
+def _encode_player_info(ev: PlayerInfo) -> bytes:
+    data = bytearray(_two_bytes.pack(PLAYER_INFO, len(ev.players)))
+    for p in ev.players:
+        data += _two_bytes.pack(PIECES[p['piece']], p['turn'])
+    return bytes(data)
+
+
+_EVENT_ENCODERS = {
+    PiecePlaced: lambda ev: _four_bytes.pack(PIECE_PLACED, PIECES[ev.player], ev.row << 1 | SIDES[ev.side], ev.turn),
+    PlayerConnected: lambda ev: _three_bytes.pack(CONNECTION, PIECES[ev.player], ev.turn_order) + ev.player_id.encode('ascii'),
+    PlayerDisconnected: lambda ev: _two_bytes.pack(DISCONNECTION, PIECES[ev.player]),
+    PlayerInfo: _encode_player_info,
+    GameOver: lambda ev: _two_bytes.pack(GAME_OVER, PIECES[ev.winner]),
+    PiecePlacedError: lambda ev: _two_bytes.pack(PIECE_PLACED_ERROR, ev.turn)
+}
+
+
+def encode_event(ev: SideStackerEvent) -> bytes:
+    """
+    Encode a game event as a server message.
+    """
+    encoder = _EVENT_ENCODERS.get(type(ev))
+    if encoder is None:
+        raise ValueError('Unable to encode event of type %s' % type(ev).__name__)
+    return encoder(ev)
+
+
+def encode_snapshot(snapshot: dict) -> bytes:
+    """
+    Encode a snapshot, as returned by `SideStacker.snapshot`, as a server message.
+    """
+    data = bytearray(_five_bytes.pack(SNAPSHOT,
+                                      snapshot['turn'],
+                                      PIECES[snapshot['player_turn']],
+                                      snapshot['is_over'],
+                                      PIECES[snapshot['winner']]))
+    for row in snapshot['board']:
+        data.extend(PIECES[p] for p in row)
+    return bytes(data)
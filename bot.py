@@ -1,22 +1,48 @@
 import random
+import threading
 import time
 
-from sidestacker import is_move_legal, get_next_free_position, evaluate_move
+from typing import Tuple
+
+from metrics import histogram
+from observers import ObserverQueue
+from profiling import TRACES
+from sidestacker import GameView, WIN_WINDOWS, is_move_legal, get_next_free_position, evaluate_move
 from events import *
 
+THINK_SECONDS = histogram('bot_think_seconds', 'Time taken by bots to choose a move')
+
+# Score of a won position, positions won sooner score higher
+WIN_SCORE = 1000
+
 
 class Bot:
     """
     This class implements a simple bot that plays the game by responding to game events.
 
     The strategy is to look for the next available space going from top to bottom, left to right in the board.
+
+    The bot doesn't keep a copy of the board, it reads the view of its game when it has to
+    move. A `board` can be given to play on it instead of the game's, eg: to test a strategy.
+
+    Two strategies are available:
+        - greedy: Play a winning move, otherwise block the other player's winning move,
+          otherwise play a random move.
+        - random: Play a random move.
     """
-    def __init__(self, game_instance, player_id, board = None):
+    STRATEGIES = ('greedy', 'random')
+
+    def __init__(self, game_instance, player_id, board = None, start_delay = 1, strategy = 'greedy'):
+        if strategy not in self.STRATEGIES:
+            raise ValueError('Invalid strategy')
         self.game = game_instance
         self.player_id = player_id
         self.turn = None
-        self.board = board or [[None] * 7 for _ in range(7)]
+        # Only set to play on a given board instead of the game's
+        self.board = board
         self.player_piece = None
+        self.start_delay = start_delay
+        self.strategy = strategy
 
     def send(self, ev):
         """
@@ -30,21 +56,19 @@ class Bot:
     def close(self):
         pass
 
-    def process_game_events(self, ev):
-        if isinstance(ev, PlayerConnected):
-            self._handle_player_connected(ev)
-        elif isinstance(ev, PlayerDisconnected):
-            pass
-        elif isinstance(ev, PlayerInfo):
-            self._handle_player_info(ev)
-            pass
-        elif isinstance(ev, GameOver):
-            pass
-        elif isinstance(ev, PiecePlaced):
-            self._handle_piece_placed(ev)
-        elif isinstance(ev, PiecePlacedError):
-            print('Piece placed error: %s' % ev.detail)
-            pass
+    def observe(self, queue: Optional[ObserverQueue] = None):
+        """
+        Subscribe the bot to the events of its game it has to respond to.
+
+        With a `queue` the bot thinks and moves from the worker of the queue instead of the
+        thread of the other player, the queue is closed once the game is over.
+        """
+        self.game.add_observer(self._handle_player_connected, (PlayerConnected,), queue)
+        self.game.add_observer(self._handle_player_info, (PlayerInfo,), queue)
+        self.game.add_observer(self._handle_piece_placed, (PiecePlaced,), queue)
+        self.game.add_observer(self._handle_piece_placed_error, (PiecePlacedError,), queue)
+        if queue is not None:
+            self.game.add_observer(queue.close, (GameOver,))
 
     def _handle_player_connected(self, ev: PlayerConnected):
         """
@@ -52,27 +76,45 @@ class Bot:
 
         Once this bot connects to the game instance, this is the first event that
         should be received.
+        Connection events of other players are ignored.
         """
+        if ev.player_id != self.player_id:
+            return
         self.player_piece = ev.player
         self.turn = ev.turn_order
 
     def _handle_player_info(self, ev: PlayerInfo):
         """
-        Check if the bot has the first turn and if it does, do the first move.
+        Check if the bot has the first turn and if it does, do the first move once
+        both players are connected.
 
         This should be the second event received, if the bot is first to move the
         client UI might not be ready to process piece placements, so we delay a second
-        the first move.
+        the first move. The move is made from a timer, as the game is locked while the
+        bot is notified.
         """
-        if self.turn == 0:
+        if self.turn == 0 and len(ev.players) == 2:
             # Delay piece placement until client UI is ready
-            time.sleep(1)
-            self.do_move()
+            if self.start_delay > 0:
+                timer = threading.Timer(self.start_delay, self.do_move)
+                timer.daemon = True
+                timer.start()
+            else:
+                self.do_move()
+
+    def current_board(self):
+        """
+        The board the bot plays on, the given one or the board of the game's view.
+        """
+        return self.game.view().board if self.board is None else self.board
 
     def get_available_moves(self):
         """
         Get a list of legal moves for the current board
         """
+        if self.board is None:
+            return set(self.game.view().legal_moves)
+
         available_moves = set()
 
         for r in range(7):
@@ -91,9 +133,10 @@ class Bot:
         Get all winning moves that win the game for the given piece
         """
         winning_moves = set()
+        board = self.current_board()
 
         for (side, row, col) in available_moves:
-            if evaluate_move(self.board, row, col, piece):
+            if evaluate_move(board, row, col, piece):
                 winning_moves.add((side, row))
 
         return winning_moves
@@ -114,34 +157,132 @@ class Bot:
         return self.get_winning_moves_for_piece(available_moves,
                                                 'X' if self.player_piece == 'C' else 'C')
 
-    def do_move(self):
+    def choose_move(self) -> Optional[Tuple[Literal['L', 'R'], int]]:
         """
-        Place a piece on the board looking for the first available space, top to bottom, left to right.
+        Choose the side and row of the next piece following the bot strategy.
+        Returns None if there's no legal move, eg: the game is over.
         """
         am = self.get_available_moves()
-        wm = self.get_winning_moves(am)
-        if len(wm) > 0:
-            (side, row) = wm.pop()
-            self.game.place_piece(self.player_id, row, side)
-            return
+        if self.strategy == 'greedy':
+            wm = self.get_winning_moves(am)
+            if len(wm) > 0:
+                return wm.pop()
 
-        bm = self.get_blocking_moves(am)
-        if len(bm) > 0:
-            (side, row) = bm.pop()
-            self.game.place_piece(self.player_id, row, side)
-            return
+            bm = self.get_blocking_moves(am)
+            if len(bm) > 0:
+                return bm.pop()
 
+        if not am:
+            return None
         rm = random.choice(tuple(am))
-        self.game.place_piece(self.player_id, rm[1], rm[0])
+        return rm[0], rm[1]
 
+    def do_move(self):
+        """
+        Place a piece on the board looking for the first available space, top to bottom, left to right.
+        """
+        start = time.perf_counter()
+        move = self.choose_move()
+        duration = time.perf_counter() - start
+        THINK_SECONDS.observe(duration)
+        if TRACES and self.game.id in TRACES:
+            TRACES[self.game.id].record('bot', 'choose_move', start, duration)
+        if move is not None:
+            self.game.place_piece(self.player_id, move[1], move[0])
+
+
+    def _handle_piece_placed_error(self, ev: PiecePlacedError):
+        print('Piece placed error: %s' % ev.detail)
 
     def _handle_piece_placed(self, ev: PiecePlaced):
         """
-        Update the bot state with the given message, and do a move if it's the bot turn.
+        Do a move if it's the bot turn.
         """
-        row = ev.row
-        col = get_next_free_position(self.board, row, ev.side)
-        self.board[row][col] = ev.player
-
         if ev.player != self.player_piece:
             self.do_move()
+
+
+class _BudgetExhausted(Exception):
+    pass
+
+
+def search(view: GameView, max_nodes=5000) -> Optional[Tuple[Tuple[Literal['L', 'R'], int], float, int]]:
+    """
+    Search the best move for the player of the turn of `view`, visiting up to `max_nodes` positions.
+
+    The search is a negamax with alpha-beta pruning that goes one move deeper each iteration
+    until it runs out of nodes, a lost or won position is found, or the board is full. Positions
+    at the search horizon are scored by the windows of four positions each player can still
+    complete.
+
+    Returns ((side, row), score, depth) of the last completed iteration, the score is from the
+    point of view of the player of the turn: WIN_SCORE minus the moves to the win when the player
+    can force a win, the negative when the other player can. Returns None if there's no legal move.
+    """
+    if not view.legal_moves:
+        return None
+
+    nodes = [0]
+    best = None
+    for depth in range(1, 7 * 7 - view.turn + 1):
+        try:
+            (score, move) = _negamax(view, depth, -WIN_SCORE - 1, WIN_SCORE + 1, 0,
+                                     max_nodes if best is not None else None, nodes,
+                                     best[0] if best is not None else None)
+        except _BudgetExhausted:
+            break
+        best = (move, score, depth)
+        if abs(score) > WIN_SCORE - 7 * 7:
+            break
+    return best
+
+
+def _negamax(view: GameView, depth, alpha, beta, ply, max_nodes, nodes, first_move=None):
+    nodes[0] += 1
+    if max_nodes is not None and nodes[0] > max_nodes:
+        raise _BudgetExhausted()
+    if view.is_over:
+        # The player that moved last won, or the board is full
+        return (0 if view.winner is None else ply - WIN_SCORE), None
+    if depth == 0:
+        return _score(view), None
+
+    moves = [(side, row) for (side, row, _) in view.legal_moves]
+    if first_move in moves:
+        moves.remove(first_move)
+        moves.insert(0, first_move)
+
+    best_move = None
+    for move in moves:
+        (score, _) = _negamax(view.play(move[1], move[0]), depth - 1, -beta, -alpha, ply + 1, max_nodes, nodes)
+        score = -score
+        if best_move is None or score > alpha:
+            best_move = move
+            alpha = max(alpha, score)
+        if alpha >= beta:
+            break
+    return alpha, best_move
+
+
+def _score(view: GameView) -> int:
+    """
+    Score a position for the player of the turn, by the windows of four positions only one
+    player has pieces in, weighted by the square of its pieces.
+    """
+    board = view.board
+    score = 0
+    for window in WIN_WINDOWS:
+        own = other = 0
+        for (row, col) in window:
+            piece = board[row][col]
+            if piece is None:
+                continue
+            if piece == view.player_turn:
+                own += 1
+            else:
+                other += 1
+        if other == 0:
+            score += own * own
+        elif own == 0:
+            score -= other * other
+    return score
@@ -1,10 +1,19 @@
 import logging
+import threading
+import time
 import uuid
+from collections import deque
 from json import dumps, loads
 
+from binary_protocol import encode_event, encode_snapshot, decode_piece_placement
 from bot import Bot
 from events import *
+from metrics import histogram
+from observers import ObserverQueue
 from sidestacker import SideStacker
+from spectators import SpectatorChannel, Spectator
+
+SEND_SECONDS = histogram('websocket_send_seconds', 'Time to send a message to a player')
 
 
 class GameConnectionHandler:
@@ -17,19 +26,60 @@ class GameConnectionHandler:
     - Connecting players to their game instances
     - Sending messages from the game instance to the respective players
     - Sending messages from the players to their respective game instance
+    - Broadcasting game events to the spectators of a game
+    - Resynchronizing players that reconnect to their game
+
+    When a player's connection is lost, the player keeps its place in the game for
+    `reconnect_grace` seconds. If the player doesn't reconnect in that time, it's disconnected
+    from the game and the other player wins.
+
+    New games are taken from a pool of up to `pool_size` pre-created instances, which
+    is filled with `prewarm` outside of the requests. Once the pool is down to half its
+    size, it's filled again from a background thread.
+
+    Game ids start with `id_prefix`, when several processes serve games the prefix identifies
+    the process that holds a game, so its requests can be routed to it.
     """
 
-    def __init__(self, logger=logging.getLogger('GameConnectionHandler')):
+    def __init__(self, logger=logging.getLogger('GameConnectionHandler'), spectator_buffer_size=64,
+                 reconnect_grace=30, pool_size=0, id_prefix=''):
         self.games = {}
+        self.id_prefix = id_prefix
         self._log = logger
+        self.spectator_buffer_size = spectator_buffer_size
+        self.reconnect_grace = reconnect_grace
+        self.pool_size = pool_size
+        self._pool = deque()
+        self._pool_lock = threading.Lock()
+        self._refilling = False
+
+    def prewarm(self):
+        """
+        Fill the pool of game instances up to its size.
+        """
+        with self._pool_lock:
+            while len(self._pool) < self.pool_size:
+                self._pool.append(self._create_sidestacker_instance(self._new_game_id()))
 
     def new_game(self, is_against_bot = False):
-        game_id = str(uuid.uuid4())
+        try:
+            game_instance = self._pool.popleft()
+        except IndexError:
+            game_instance = self._create_sidestacker_instance(self._new_game_id())
+        if len(self._pool) < self.pool_size // 2:
+            self._refill_pool()
+        game_id = game_instance.id
         self._log.debug('[gId: %s] A new game was created' % game_id)
-        game_instance = self._create_sidestacker_instance(game_id)
         self.games[game_id] = {
             'game': game_instance,
             'players': {},
+            # Players that negotiated the binary protocol
+            'binary_players': set(),
+            # Timers of the players with a lost connection, indexed by player id
+            'pending_reconnects': {},
+            'spectators': SpectatorChannel(lambda: self._snapshot_message(game_instance),
+                                           self.spectator_buffer_size,
+                                           game_instance._lock),
             'is_against_bot': is_against_bot
         }
 
@@ -38,7 +88,17 @@ class GameConnectionHandler:
     def has_game(self, game_id):
         return game_id in self.games
 
-    def add_connection(self, game_id, ws, player_id):
+    def remove_game(self, game_id):
+        """
+        Forget a game that won't be played, eg: it couldn't be saved.
+        """
+        self.games.pop(game_id, None)
+
+    def add_connection(self, game_id, ws, player_id, binary=False):
+        """
+        Connect a player to a game.
+        If `binary` is set, the messages to this player are sent using the binary protocol.
+        """
         if game_id not in self.games:
             raise ValueError('Invalid game_id')
 
@@ -46,6 +106,8 @@ class GameConnectionHandler:
 
         game = self.games[game_id]
         game['players'][player_id] = ws
+        if binary:
+            game['binary_players'].add(player_id)
 
         ss = game['game']
         ss.connect(player_id)
@@ -55,99 +117,263 @@ class GameConnectionHandler:
             bot = Bot(ss, bot_id)
             game['players'][bot_id] = bot
 
-            ss.add_observer(bot.process_game_events)
+            bot.observe(ObserverQueue('bot'))
             ss.connect(bot_id)
 
+    def add_spectator(self, game_id, policy='coalesce') -> Spectator:
+        """
+        Subscribe a read-only viewer to the events of a game.
+        The viewer is expected to be drained by its own connection thread.
+        """
+        if game_id not in self.games:
+            raise ValueError('Invalid game_id')
+        if policy not in ('drop', 'coalesce', 'disconnect'):
+            raise ValueError('Invalid slow consumer policy')
+
+        self._log.debug('[gId: %s] A spectator connected' % game_id)
+        return self.games[game_id]['spectators'].subscribe(policy)
+
     def handle_client_message(self, game_id, player_id, message):
         """
         Handle messages sent by the client.
         At this time the only message type is 'piece-placement'
+
+        Binary messages are decoded with the binary protocol, text messages are expected to be json.
+        Messages that can't be decoded are logged and dropped.
+
+        As every message is a piece placement, messages sent out of the player's turn are
+        answered with an error before they are parsed.
         """
-        json = loads(message)
-        if 'type' not in json:
+        ss = self.games[game_id]['game']
+        if not ss.check_turn(player_id):
+            return
+
+        if isinstance(message, bytes):
+            try:
+                (row, side) = decode_piece_placement(message)
+            except ValueError:
+                self._log.error('[gId: %s][pId: %s] Invalid binary message: %r', game_id, player_id, message)
+                return
+            ss.place_piece(player_id, row, side)
+            return
+
+        try:
+            json = loads(message)
+        except ValueError:
+            self._log.error('[gId: %s][pId: %s] Invalid json message: %r', game_id, player_id, message)
+            return
+        if not isinstance(json, dict) or 'type' not in json:
             self._log.error("json message doesn't have a type field: %s" % message)
             return
 
         if json['type'] == 'piece-placement':
             self._log.debug('[gId: %s][pId: %s] A player placed a piece' % (game_id, player_id))
-            ss = self.games[game_id]['game']
-            ss.place_piece(player_id, json['row'], json['side'])
+            # Missing or invalid positions are answered with an error by the game
+            ss.place_piece(player_id, json.get('row'), json.get('side'))
         else:
             self._log.warning("Unable to handle message of unknown type '%s' of message: '%s'" % (json['type'], message))
 
+    def get_game(self, game_id) -> SideStacker:
+        if game_id not in self.games:
+            raise ValueError('Invalid game_id')
+        return self.games[game_id]['game']
+
+    def reconnect(self, game_id, ws, player_id, last_turn=None, binary=False):
+        """
+        Reconnect a player that lost its connection.
+        The player receives its connection message followed by the pieces placed after
+        `last_turn`. If those aren't available, a snapshot of the game is sent instead.
+        """
+        if game_id not in self.games:
+            raise ValueError('Invalid game_id')
+
+        game = self.games[game_id]
+        ss = game['game']
+        # Moves made meanwhile are sent once the player is resynchronized, after the replayed ones
+        with ss._lock:
+            timer = game['pending_reconnects'].pop(player_id, None)
+            if timer is None:
+                raise ValueError('Invalid player_id')
+            timer.cancel()
+
+            self._log.debug('[gId: %s][pId: %s] A player reconnected' % (game_id, player_id))
+
+            game['players'][player_id] = ws
+            if binary:
+                game['binary_players'].add(player_id)
+            else:
+                game['binary_players'].discard(player_id)
+
+            self._on_connect(PlayerConnected(game_id, player_id, *ss.players[player_id]))
+
+            events = None if last_turn is None else ss.events_since(last_turn)
+            if events is None:
+                ws.send(encode_snapshot(ss.snapshot()) if binary else self._snapshot_message(ss))
+            else:
+                for ev in events:
+                    ws.send(encode_event(ev) if binary else self._piece_placed_message(ev))
+
     def close_connection(self, game_id, player_id):
-        game = self.games[game_id]['game']
-        game.disconnec(player_id)
+        """
+        Handle a lost connection.
+        The player is disconnected from the game if it doesn't reconnect in time.
+        """
+        game = self.games[game_id]
+        game['players'].pop(player_id, None)
+        game['binary_players'].discard(player_id)
+
+        ss = game['game']
+        if ss.is_over or player_id not in ss.players:
+            return
+
+        if self.reconnect_grace <= 0:
+            ss.disconnect(player_id)
+            return
+
+        timer = threading.Timer(self.reconnect_grace, self._expire_connection, (game_id, player_id))
+        timer.daemon = True
+        game['pending_reconnects'][player_id] = timer
+        timer.start()
+
+    def _expire_connection(self, game_id, player_id):
+        game = self.games[game_id]
+        if game['pending_reconnects'].pop(player_id, None) is None:
+            return
+
+        self._log.debug('[gId: %s][pId: %s] A player failed to reconnect' % (game_id, player_id))
+        ss = game['game']
+        if not ss.is_over:
+            ss.disconnect(player_id)
+
+    def _refill_pool(self):
+        with self._pool_lock:
+            if self._refilling:
+                return
+            self._refilling = True
+
+        def refill():
+            try:
+                self.prewarm()
+            except Exception:
+                self._log.exception('Unable to fill the pool of games')
+            finally:
+                self._refilling = False
+
+        threading.Thread(target=refill, name='GamePool', daemon=True).start()
+
+    def _new_game_id(self):
+        return self.id_prefix + str(uuid.uuid4())
 
     def _create_sidestacker_instance(self, game_id):
         ss = SideStacker(game_id)
-        ss.add_observer(self._process_game_events)
+        for (event_type, handler) in self._event_handlers().items():
+            ss.add_observer(handler, (event_type,))
         return ss
 
-    def _process_game_events(self, ev):
-        if isinstance(ev, PlayerConnected):
-            self._on_connect(ev)
-        elif isinstance(ev, PlayerDisconnected):
-            self._on_disconnect(ev)
-        elif isinstance(ev, PlayerInfo):
-            self._on_player_info(ev)
-        elif isinstance(ev, GameOver):
-            self._on_game_over(ev)
-        elif isinstance(ev, PiecePlaced):
-            self._on_piece_placed(ev)
-        elif isinstance(ev, PiecePlacedError):
-            self._on_piece_placed_error(ev)
+    def _event_handlers(self):
+        return {
+            PlayerConnected: self._on_connect,
+            PlayerDisconnected: self._on_disconnect,
+            PlayerInfo: self._on_player_info,
+            GameOver: self._on_game_over,
+            PiecePlaced: self._on_piece_placed,
+            PiecePlacedError: self._on_piece_placed_error
+        }
+
+    def _snapshot_message(self, ss: SideStacker):
+        return dumps(dict(type='snapshot', **ss.snapshot()))
+
+    def _broadcast(self, game, ev: SideStackerEvent, message: str):
+        """
+        Send the event to every player of the game, the binary message is only encoded
+        if a player negotiated the binary protocol.
+        """
+        binary_players = game['binary_players']
+        binary_message = None
+        for (player_id, ws) in game['players'].items():
+            if player_id in binary_players:
+                if binary_message is None:
+                    binary_message = encode_event(ev)
+                start = time.perf_counter()
+                ws.send(binary_message)
+            else:
+                start = time.perf_counter()
+                ws.send(message)
+            SEND_SECONDS.observe(time.perf_counter() - start)
+
+    def _send(self, game, player_id, ev: SideStackerEvent, message: str):
+        ws = game['players'].get(player_id)
+        if ws is None:
+            # The player lost its connection
+            return
+        if player_id in game['binary_players']:
+            message = encode_event(ev)
+        start = time.perf_counter()
+        ws.send(message)
+        SEND_SECONDS.observe(time.perf_counter() - start)
 
     def _on_connect(self, ev: PlayerConnected):
         game = self.games[ev.game_id]
-        ws = game['players'][ev.player_id]
-        ws.send(dumps({
+        self._send(game, ev.player_id, ev, dumps({
             'type': 'connection',
             'player': ev.player,
-            'turn': ev.turn_order
+            'turn': ev.turn_order,
+            # Allows the player to reconnect to the game
+            'player_id': ev.player_id
         }))
 
     def _on_disconnect(self, ev: PlayerDisconnected):
         game = self.games[ev.game_id]
-        for (_, ws) in game['players'].items():
-            ws.send(dumps({
-                'type': 'disconnection',
-                'player': ev.player
-            }))
+        message = dumps({
+            'type': 'disconnection',
+            'player': ev.player
+        })
+        self._broadcast(game, ev, message)
+        game['spectators'].publish(message)
 
     def _on_player_info(self, ev: PlayerInfo):
         game = self.games[ev.game_id]
-        for (_, ws) in game['players'].items():
-            ws.send(dumps({
-                'type': 'player_info',
-                'players': ev.players
-            }))
+        message = dumps({
+            'type': 'player_info',
+            'players': ev.players
+        })
+        self._broadcast(game, ev, message)
+        game['spectators'].publish(message)
 
     def _on_game_over(self, ev: GameOver):
         game = self.games[ev.game_id]
+        message = dumps({
+            'type': 'game_over',
+            'winner': ev.winner
+        })
+        self._broadcast(game, ev, message)
         for (_, ws) in game['players'].items():
-            ws.send(dumps({
-                'type': 'game_over',
-                'winner': ev.winner
-            }))
             ws.close()
+        for (_, timer) in game['pending_reconnects'].items():
+            timer.cancel()
+        game['pending_reconnects'].clear()
+        game['spectators'].publish(message)
+        game['spectators'].close()
 
     def _on_piece_placed(self, ev: PiecePlaced):
         game = self.games[ev.game_id]
-        for (_, ws) in game['players'].items():
-            ws.send(dumps({
-                'type': 'piece_placed',
-                'player': ev.player,
-                'row': ev.row,
-                'side': ev.side,
-                'turn': ev.turn
-            }))
+        message = self._piece_placed_message(ev)
+        self._broadcast(game, ev, message)
+        game['spectators'].publish(message)
+
+    def _piece_placed_message(self, ev: PiecePlaced):
+        return dumps({
+            'type': 'piece_placed',
+            'player': ev.player,
+            'row': ev.row,
+            'side': ev.side,
+            'turn': ev.turn
+        })
 
     def _on_piece_placed_error(self, ev: PiecePlacedError):
         game = self.games[ev.game_id]
         # Send the error to the player only
-        ws = game['players'][ev.player_id]
-        ws.send(dumps({
+        self._send(game, ev.player_id, ev, dumps({
             'type': 'piece_placed_error',
             'turn': ev.turn
         }))
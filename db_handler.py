@@ -1,8 +1,22 @@
+import os
+import threading
 from sqlite3 import Connection
+from typing import Iterable, Optional
 
 from events import GameOver, PiecePlaced
+from metrics import histogram
+from observers import ObserverQueue
+from profiling import traced
 from sidestacker import SideStacker
 
+STATEMENT_SECONDS = histogram('db_statement_seconds', 'Time to run a database statement', ['statement'])
+
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'init-db.sql')
+with open(SCHEMA_FILE) as f:
+    SCHEMA = f.read()
+# Seconds a statement waits for the lock of the database, eg: while games are archived
+BUSY_TIMEOUT = 30
+
 
 class DBHandler:
     """
@@ -11,44 +25,144 @@ class DBHandler:
     It's made as an observer that can be notified of SideStacker events.
     Depending on the event the respective method is called to save the data.
 
+    Given a `queue`, the events are saved by the worker of the queue instead of the
+    thread that changed the game, so the moves don't wait for the database.
+
+    Old games can be moved out of this database to the files of an `archive.GameArchive`,
+    given the `archive`, games that aren't in this database are looked up in it.
+
+    Each thread keeps its own connection, opened with its first statement. Creating the handler
+    doesn't touch the database, so it can be created before the server forks its workers and
+    each worker opens its own connections.
     """
-    def __init__(self, file="db.sqlite"):
+    def __init__(self, file="db.sqlite", queue: Optional[ObserverQueue] = None, archive=None):
         self.file = file
-        self.initialize()
+        self.queue = queue
+        self.archive = archive
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # Process that created the tables, they're created once per process
+        self._initialized_pid = None
 
     def initialize(self):
-        with Connection(self.file) as con:
-            with open('init-db.sql') as f:
-                script = f.read()
+        with self._lock:
+            if self._initialized_pid == os.getpid():
+                return
+            con = Connection(self.file, timeout=BUSY_TIMEOUT)
+            try:
                 cur = con.cursor()
-                cur.executescript(script)
+                cur.executescript(SCHEMA)
                 cur.close()
+                con.commit()
+            finally:
+                con.close()
+            self._initialized_pid = os.getpid()
+
+    def connection(self) -> Connection:
+        """
+        Returns the connection of the calling thread, connections opened before a fork aren't reused.
+        """
+        pid = os.getpid()
+        if getattr(self._local, 'pid', None) != pid:
+            self.initialize()
+            self._local.con = Connection(self.file, timeout=BUSY_TIMEOUT)
+            self._local.pid = pid
+        return self._local.con
 
     def manage_game(self, sidestackerInstance: SideStacker):
-        sidestackerInstance.add_observer(self._process_game_events)
+        self._observe(sidestackerInstance)
         self.create_game(sidestackerInstance.id)
 
+    def manage_games(self, sidestackerInstances: Iterable[SideStacker]):
+        """
+        Manage several games at once, their rows are inserted in a single transaction.
+        """
+        sidestackerInstances = list(sidestackerInstances)
+        for ss in sidestackerInstances:
+            self._observe(ss)
+        self.create_games([ss.id for ss in sidestackerInstances])
+
+    @STATEMENT_SECONDS.labels('create_game').timed
+    @traced('db', 'create_game')
     def create_game(self, game_id):
-        with Connection(self.file) as con:
+        with self.connection() as con:
             cur = con.cursor()
             cur.execute('insert into game(game_id) values (?)', (game_id,))
             cur.close()
 
+    @STATEMENT_SECONDS.labels('create_games').timed
+    def create_games(self, game_ids):
+        with self.connection() as con:
+            cur = con.cursor()
+            cur.executemany('insert into game(game_id) values (?)', ((game_id,) for game_id in game_ids))
+            cur.close()
+
+    @STATEMENT_SECONDS.labels('save_games').timed
+    def save_games(self, games):
+        """
+        Save finished games in a single transaction.
+        Each game is a tuple of (game_id, winner, moves) where moves is a list of
+        (row, side, piece, turn) tuples.
+        """
+        with self.connection() as con:
+            cur = con.cursor()
+            for (game_id, winner, moves) in games:
+                cur.execute('insert into game(game_id, winner) values (?, ?)', (game_id, winner))
+                cur.executemany('insert into game_moves (game_id, row, side, piece, turn) values (?, ?, ?, ?, ?)',
+                                ((game_id,) + move for move in moves))
+            cur.close()
+
+    @STATEMENT_SECONDS.labels('add_move').timed
+    @traced('db', 'add_move')
     def add_move(self, game_id, row, side, piece, turn):
-        with Connection(self.file) as con:
+        with self.connection() as con:
             cur = con.cursor()
             cur.execute('insert into game_moves (game_id, row, side, piece, turn) values (?, ?, ?, ?, ?)',
                         (game_id, row, side, piece, turn))
             cur.close()
 
+    @STATEMENT_SECONDS.labels('save_winner').timed
+    @traced('db', 'save_winner')
     def save_winner(self, game_id, winner):
-        with Connection(self.file) as con:
+        with self.connection() as con:
             cur = con.cursor()
             cur.execute('update game set winner = ? where game_id = ?', (winner, game_id))
             cur.close()
 
-    def _process_game_events(self, ev):
-        if isinstance(ev, GameOver):
-            self.save_winner(ev.game_id, 'tie' if ev.winner is None else ev.winner)
-        elif isinstance(ev, PiecePlaced):
-            self.add_move(ev.game_id, ev.row, ev.side, ev.player, ev.turn)
\ No newline at end of file
+    @STATEMENT_SECONDS.labels('get_game').timed
+    def get_game(self, game_id) -> Optional[dict]:
+        """
+        Returns the game with its moves, or None if it doesn't exist.
+        """
+        with self.connection() as con:
+            game = read_game(con, game_id)
+            if game is None and self.archive is not None:
+                game = self.archive.find_game(con, game_id)
+        return game
+
+    def _observe(self, sidestackerInstance: SideStacker):
+        sidestackerInstance.add_observer(self._on_game_over, (GameOver,), self.queue)
+        sidestackerInstance.add_observer(self._on_piece_placed, (PiecePlaced,), self.queue)
+
+    def _on_game_over(self, ev: GameOver):
+        self.save_winner(ev.game_id, 'tie' if ev.winner is None else ev.winner)
+
+    def _on_piece_placed(self, ev: PiecePlaced):
+        self.add_move(ev.game_id, ev.row, ev.side, ev.player, ev.turn)
+
+
+def read_game(con: Connection, game_id, schema='main') -> Optional[dict]:
+    """
+    Read a game and its moves from the given schema of the connection, eg: an attached database.
+    """
+    cur = con.cursor()
+    cur.execute('select winner, game_start from %s.game where game_id = ?' % schema, (game_id,))
+    row = cur.fetchone()
+    if row is None:
+        cur.close()
+        return None
+    cur.execute('select row, side, piece, turn from %s.game_moves where game_id = ? order by turn' % schema,
+                (game_id,))
+    moves = cur.fetchall()
+    cur.close()
+    return {'game_id': game_id, 'winner': row[0], 'game_start': row[1], 'moves': moves}
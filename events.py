@@ -4,13 +4,19 @@ from typing import Literal, Optional
 class SideStackerEvent:
     """
     This base class represents an event of a sidestacker game
+
+    Events are the most allocated objects of a game, so they declare their attributes
+    in `__slots__` to avoid an instance dict. Events shouldn't be modified once created.
     """
+    __slots__ = ('game_id',)
 
     def __init__(self, game_id: str):
         self.game_id = game_id
 
 
 class PlayerConnected(SideStackerEvent):
+    __slots__ = ('player_id', 'player', 'turn_order')
+
     def __init__(self, game_id: str, player_id: str, player: Literal['X', 'C'], turn_order: Literal[0, 1]):
         super().__init__(game_id)
         self.player_id = player_id
@@ -19,18 +25,24 @@ class PlayerConnected(SideStackerEvent):
 
 
 class PlayerDisconnected(SideStackerEvent):
+    __slots__ = ('player',)
+
     def __init__(self, game_id: str, player: Literal['X', 'C']):
         super().__init__(game_id)
         self.player = player
 
 
 class GameOver(SideStackerEvent):
+    __slots__ = ('winner',)
+
     def __init__(self, game_id: str, winner: Optional[Literal['X', 'C']]):
         super().__init__(game_id)
         self.winner = winner
 
 
 class PiecePlaced(SideStackerEvent):
+    __slots__ = ('player', 'row', 'side', 'turn')
+
     def __init__(self, game_id: str, player: Literal['X', 'C'], row: int, side: Literal['L', 'R'], turn: int):
         super().__init__(game_id)
         self.player = player
@@ -40,6 +52,8 @@ class PiecePlaced(SideStackerEvent):
 
 
 class PiecePlacedError(SideStackerEvent):
+    __slots__ = ('player_id', 'turn', 'detail')
+
     def __init__(self, game_id: str, player_id: str, turn: int, detail: str):
         super().__init__(game_id)
         self.player_id = player_id
@@ -48,6 +62,12 @@ class PiecePlacedError(SideStackerEvent):
 
 
 class PlayerInfo(SideStackerEvent):
+    __slots__ = ('players',)
+
     def __init__(self, game_id: str, players):
         super().__init__(game_id)
         self.players = players
+
+
+# Every concrete event type, observers are registered by these types
+EVENT_TYPES = (PlayerConnected, PlayerDisconnected, GameOver, PiecePlaced, PiecePlacedError, PlayerInfo)
@@ -0,0 +1,94 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, Tuple
+
+from bot import WIN_SCORE, search
+from metrics import counter, histogram
+from sidestacker import GameView
+
+HINTS = counter('hints_total', 'Hints requested, by how they were answered', ['result'])
+HINT_SEARCH_SECONDS = histogram('hint_search_seconds', 'Time to search the move of a hint')
+_hit = HINTS.labels('hit')
+_coalesced = HINTS.labels('coalesced')
+_computed = HINTS.labels('computed')
+
+
+class HintService:
+    """
+    This class answers hint requests with the best move of a position, as searched by the bot.
+
+    Results are kept in a LRU cache of up to `max_entries` positions, keyed by the Zobrist hash
+    of the position along with the node budget of their search. A cached result answers the
+    requests of a budget up to its own, a larger budget searches the position again. Requests
+    for a position that is being searched with at least their budget wait for that search
+    instead of starting another one, so a position watched by many players costs a single search.
+    """
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self._cache: Dict[int, Tuple[int, dict]] = OrderedDict()
+        self._searches: Dict[int, Tuple[int, Future]] = {}
+        self._lock = threading.Lock()
+
+    def hint(self, view: GameView, budget: int) -> dict:
+        """
+        Returns the hint of the position of `view`, searching up to `budget` positions.
+        The hint is a dict with the side and row of the move, None if there's no legal move,
+        its score between -1 and 1 for the player of the turn and the depth of the search.
+        """
+        key = view.key
+        with self._lock:
+            (cached_budget, hint) = self._cache.get(key, (0, None))
+            if cached_budget >= budget:
+                self._cache.move_to_end(key)
+                _hit.inc()
+                return hint
+            (search_budget, future) = self._searches.get(key, (0, None))
+            searching = search_budget < budget
+            if searching:
+                future = Future()
+                self._searches[key] = (budget, future)
+
+        if not searching:
+            _coalesced.inc()
+            return future.result()
+
+        try:
+            hint = self._search(view, budget)
+        except BaseException as e:
+            with self._lock:
+                self._end_search(key, future)
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            self._end_search(key, future)
+            if self._cache.get(key, (0, None))[0] < budget:
+                self._cache[key] = (budget, hint)
+            self._cache.move_to_end(key)
+            if len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        future.set_result(hint)
+        _computed.inc()
+        return hint
+
+    def _end_search(self, key: int, future: Future):
+        # A search of a larger budget may have replaced this one
+        if self._searches.get(key, (0, None))[1] is future:
+            del self._searches[key]
+
+    def _search(self, view: GameView, budget: int) -> dict:
+        start = time.perf_counter()
+        result = search(view, budget)
+        HINT_SEARCH_SECONDS.observe(time.perf_counter() - start)
+        if result is None:
+            return {'side': None, 'row': None, 'score': 0, 'depth': 0}
+        ((side, row), score, depth) = result
+        return {
+            'side': side,
+            'row': row,
+            'score': max(-1.0, min(1.0, score / WIN_SCORE)),
+            'depth': depth
+        }
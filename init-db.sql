@@ -11,4 +11,6 @@ create table if not exists game_moves (
     piece text,
     turn integer,
     foreign key(game_id) references game(game_id)
-);
\ No newline at end of file
+);
+
+create index if not exists game_moves_game_id on game_moves(game_id);
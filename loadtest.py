@@ -0,0 +1,237 @@
+"""
+WebSocket load generator for a locally running server.
+
+Simulated players create games with `/api/new-game`, join them through `/api/game/<id>`
+and play random legal moves until the game is over, then start a new one. The amount of
+concurrent games is ramped up in steps, and for each step the connect time, the latency
+between sending a move and receiving its broadcast, the error rate and the server cpu
+usage are reported.
+
+The server rate limits messages by connection and by ip address. As every simulated player
+shares the loopback address, and players with a short think time move faster than humans,
+the limits should be raised while load testing:
+
+    FLASK_IP_MESSAGE_RATE='[100000, 100000]' FLASK_CONNECTION_MESSAGE_RATE='[1000, 1000]' flask run
+    python loadtest.py --url http://127.0.0.1:5000 --ramp 1,10,50 --step-duration 20 --server-pid <pid>
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.request
+from collections import Counter
+from json import dumps, loads
+
+from simple_websocket import Client, ConnectionClosed
+
+from sidestacker import get_next_free_position, is_move_legal
+
+
+class StepStats:
+    """
+    Measurements of a single step of the ramp, shared by all the simulated players.
+    """
+
+    def __init__(self):
+        self.connect_times = []
+        self.move_latencies = []
+        self.games = 0
+        self.moves = 0
+        self.errors = Counter()
+        self._lock = threading.Lock()
+
+    def add_connect_time(self, seconds):
+        with self._lock:
+            self.connect_times.append(seconds)
+
+    def add_move_latency(self, seconds):
+        with self._lock:
+            self.move_latencies.append(seconds)
+            self.moves += 1
+
+    def add_game(self):
+        with self._lock:
+            self.games += 1
+
+    def add_error(self, kind):
+        with self._lock:
+            self.errors[kind] += 1
+
+
+def percentiles(values):
+    if not values:
+        return None
+    values = sorted(values)
+    pick = lambda p: values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))] * 1000
+    return {'p50': pick(50), 'p95': pick(95), 'p99': pick(99), 'max': values[-1] * 1000}
+
+
+def process_cpu_seconds(pid):
+    """
+    Returns the user and system cpu time used by a process, read from /proc.
+    """
+    with open('/proc/%d/stat' % pid) as f:
+        # The process name might contain spaces, the fields start after its closing parenthesis
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def new_game(base_url):
+    request = urllib.request.Request(base_url + '/api/new-game', method='POST')
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return loads(response.read())['game_id']
+
+
+def play(ws_url, stats: StepStats, think_time, timeout):
+    """
+    Play a game as a single player until it's over.
+    """
+    start = time.perf_counter()
+    ws = Client.connect(ws_url)
+    stats.add_connect_time(time.perf_counter() - start)
+
+    board = [[None] * 7 for _ in range(7)]
+    piece = None
+    player_turn = None
+    sent = {}
+    try:
+        while True:
+            data = ws.receive(timeout)
+            if data is None:
+                stats.add_error('timeout')
+                return
+            message = loads(data)
+            if message['type'] == 'connection':
+                piece = message['player']
+            elif message['type'] == 'player_info':
+                if len(message['players']) < 2:
+                    continue
+                player_turn = next(p['piece'] for p in message['players'] if p['turn'] == 0)
+            elif message['type'] == 'piece_placed':
+                if message['turn'] in sent:
+                    stats.add_move_latency(time.perf_counter() - sent.pop(message['turn']))
+                col = get_next_free_position(board, message['row'], message['side'])
+                board[message['row']][col] = message['player']
+                player_turn = 'X' if message['player'] == 'C' else 'C'
+            elif message['type'] == 'piece_placed_error':
+                stats.add_error('piece_placed_error')
+            elif message['type'] == 'game_over':
+                return
+            else:
+                continue
+
+            if player_turn is not None and player_turn == piece:
+                if think_time > 0:
+                    time.sleep(random.uniform(0, 2 * think_time))
+                moves = [(r, s) for r in range(7) for s in 'LR' if is_move_legal(board, r, s)]
+                (row, side) = random.choice(moves)
+                sent[sum(cell is not None for line in board for cell in line)] = time.perf_counter()
+                ws.send(dumps({'type': 'piece-placement', 'row': row, 'side': side}))
+                # Avoid sending another move before the broadcast of this one
+                player_turn = None
+    except ConnectionClosed:
+        stats.add_error('connection_closed')
+    finally:
+        try:
+            ws.close()
+        except ConnectionClosed:
+            # The server closes the connection once the game is over
+            pass
+
+
+def run_games(base_url, stats: StepStats, stop: threading.Event, think_time, timeout):
+    """
+    Play games between two simulated players until stopped.
+    """
+    ws_base = base_url.replace('http', 'ws', 1)
+    while not stop.is_set():
+        try:
+            game_id = new_game(base_url)
+        except OSError:
+            stats.add_error('new_game')
+            time.sleep(1)
+            continue
+
+        url = '%s/api/game/%s' % (ws_base, game_id)
+        players = [threading.Thread(target=_play_safely, args=(url, stats, think_time, timeout))
+                   for _ in range(2)]
+        for p in players:
+            p.start()
+        for p in players:
+            p.join()
+        stats.add_game()
+
+
+def _play_safely(ws_url, stats, think_time, timeout):
+    try:
+        play(ws_url, stats, think_time, timeout)
+    except Exception as e:
+        stats.add_error(type(e).__name__)
+
+
+def run_step(base_url, concurrency, duration, think_time, timeout, server_pid=None):
+    stats = StepStats()
+    stop = threading.Event()
+    cpu_start = process_cpu_seconds(server_pid) if server_pid else None
+    start = time.perf_counter()
+
+    runners = [threading.Thread(target=run_games, args=(base_url, stats, stop, think_time, timeout), daemon=True)
+               for _ in range(concurrency)]
+    for r in runners:
+        r.start()
+    time.sleep(duration)
+    stop.set()
+    for r in runners:
+        r.join()
+
+    elapsed = time.perf_counter() - start
+    report = {
+        'concurrent_games': concurrency,
+        'elapsed': elapsed,
+        'games': stats.games,
+        'moves': stats.moves,
+        'moves_per_second': stats.moves / elapsed,
+        'errors': dict(stats.errors),
+        'error_rate': sum(stats.errors.values()) / max(1, stats.moves + sum(stats.errors.values())),
+        'connect_ms': percentiles(stats.connect_times),
+        'move_latency_ms': percentiles(stats.move_latencies)
+    }
+    if server_pid:
+        report['server_cpu_percent'] = (process_cpu_seconds(server_pid) - cpu_start) / elapsed * 100
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test a local sidestacker server')
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--ramp', default='1,5,10,25,50',
+                        help='Comma separated amount of concurrent games of each step')
+    parser.add_argument('--step-duration', type=float, default=10, help='Seconds of each step')
+    parser.add_argument('--think-time', type=float, default=0.1, help='Mean seconds before each move')
+    parser.add_argument('--timeout', type=float, default=10, help='Seconds to wait for a message')
+    parser.add_argument('--server-pid', type=int, help='Pid of the server to measure its cpu usage')
+    parser.add_argument('--output', help='Write the reports as JSON to this file')
+    args = parser.parse_args(argv)
+
+    reports = []
+    for concurrency in (int(c) for c in args.ramp.split(',')):
+        report = run_step(args.url.rstrip('/'), concurrency, args.step_duration, args.think_time,
+                          args.timeout, args.server_pid)
+        reports.append(report)
+        latency = report['move_latency_ms'] or {}
+        print('games=%-4d moves/s=%-8.1f p50=%-7.2f p95=%-7.2f p99=%-7.2f errors=%-5d cpu=%s' % (
+            concurrency, report['moves_per_second'], latency.get('p50', 0), latency.get('p95', 0),
+            latency.get('p99', 0), sum(report['errors'].values()),
+            '%.0f%%' % report['server_cpu_percent'] if 'server_cpu_percent' in report else '-'))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(reports, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
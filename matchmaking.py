@@ -0,0 +1,143 @@
+import logging
+import threading
+from collections import deque
+from typing import Optional
+
+from connection_handler import GameConnectionHandler
+from db_handler import DBHandler
+
+
+class MatchTicket:
+    """
+    A player waiting for a match.
+    Once the player is paired, `game_id` holds the game both players should connect to.
+    """
+
+    def __init__(self):
+        self.game_id = None
+        self.cancelled = False
+        self._matched = threading.Event()
+
+    def wait(self, timeout=None) -> Optional[str]:
+        """
+        Wait until the player is paired, returns the game id or None if it timed out.
+        """
+        self._matched.wait(timeout)
+        return self.game_id
+
+
+class Matchmaker:
+    """
+    This class pairs players waiting for a game.
+
+    Instead of creating a game as soon as two players are waiting, the waiting players are
+    paired in batches every `batch_interval` seconds. The games of a batch are taken from the
+    pool of pre-created instances of the GameConnectionHandler and their rows are inserted
+    in a single transaction, then the pool is filled again outside of the requests.
+
+    Waiting players that time out are cancelled and skipped by the next batch.
+    """
+
+    def __init__(self, game_connection_handler: GameConnectionHandler, db_handler: DBHandler,
+                 batch_interval=0.5, logger=logging.getLogger('Matchmaker')):
+        self.game_connection_handler = game_connection_handler
+        self.db_handler = db_handler
+        self.batch_interval = batch_interval
+        self._log = logger
+        self._waiting = deque()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def request_match(self) -> MatchTicket:
+        ticket = MatchTicket()
+        with self._lock:
+            self._waiting.append(ticket)
+        return ticket
+
+    def cancel(self, ticket: MatchTicket) -> bool:
+        """
+        Cancel a ticket, returns False if the ticket was already paired.
+        """
+        with self._lock:
+            if ticket.game_id is not None:
+                return False
+            ticket.cancelled = True
+            return True
+
+    def pair_waiting(self) -> int:
+        """
+        Pair the players waiting, returns the amount of games created.
+
+        The batch is taken from the waiting players holding the lock, and its games are created
+        and inserted without it, so players can request a match or cancel meanwhile.
+        """
+        with self._lock:
+            waiting = [t for t in self._waiting if not t.cancelled]
+            self._waiting.clear()
+            if len(waiting) % 2 == 1:
+                self._waiting.append(waiting.pop())
+
+        if len(waiting) == 0:
+            return 0
+
+        games = []
+        try:
+            for _ in range(len(waiting) // 2):
+                games.append(self.game_connection_handler.new_game())
+            self.db_handler.manage_games(games)
+        except Exception:
+            # Keep the players waiting for the next batch, their games won't be played
+            for game in games:
+                self.game_connection_handler.remove_game(game.id)
+            with self._lock:
+                self._waiting.extendleft(reversed(waiting))
+            raise
+
+        matched = []
+        with self._lock:
+            requeued = []
+            for (i, game) in enumerate(games):
+                pair = waiting[2 * i:2 * i + 2]
+                if any(t.cancelled for t in pair):
+                    # A player gave up while the game was created, its partner keeps waiting
+                    self.game_connection_handler.remove_game(game.id)
+                    requeued.extend(t for t in pair if not t.cancelled)
+                    continue
+                for ticket in pair:
+                    ticket.game_id = game.id
+                matched.extend(pair)
+            self._waiting.extendleft(reversed(requeued))
+
+        for ticket in matched:
+            ticket._matched.set()
+
+        self._log.debug('Paired %d players in %d games' % (len(matched), len(matched) // 2))
+        return len(matched) // 2
+
+    def start(self):
+        """
+        Fill the pool of games and start pairing players in the background, does nothing if
+        it's already started.
+        """
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='Matchmaker', daemon=True)
+        self.game_connection_handler.prewarm()
+        self._thread.start()
+
+    @property
+    def started(self) -> bool:
+        return self._thread is not None
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.wait(self.batch_interval):
+            try:
+                if self.pair_waiting() > 0:
+                    self.game_connection_handler.prewarm()
+            except Exception:
+                self._log.exception('Unable to pair waiting players')
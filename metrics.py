@@ -0,0 +1,266 @@
+"""
+A small metrics registry exposed in the Prometheus text format.
+
+Metrics are updated from the connection threads on every move, so updates avoid locks:
+each thread writes to its own cell of the metric and the cells are only added up when
+the metrics are collected. A lock is only taken the first time a thread updates a metric,
+and when the thread exits, as its cell is then folded with the cells of the finished threads.
+
+    MOVES = counter('sidestacker_moves_total', 'Pieces placed')
+    MOVES.inc()
+
+    DB_SECONDS = histogram('db_statement_seconds', 'Statement latency', ['statement'])
+    DB_SECONDS.labels('add_move').observe(0.002)
+
+    @DB_SECONDS.labels('create_game').timed
+    def create_game(...): ...
+"""
+import abc
+import threading
+import time
+import weakref
+from bisect import bisect_left
+from functools import wraps
+from typing import Callable, Dict, Iterable, Sequence, Tuple
+
+DEFAULT_BUCKETS = (.0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+
+class _ShardedCells:
+    """
+    A set of per-thread cells, each cell is a list of `size` numbers.
+    The cell of a thread is folded into the totals of the finished threads when the thread exits.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._local = threading.local()
+        self._cells = {}
+        self._finished = [0] * size
+        self._lock = threading.Lock()
+
+    def cell(self) -> list:
+        try:
+            return self._local.cell
+        except AttributeError:
+            cell = [0] * self.size
+            # The values of a thread-local are released when its thread exits
+            owner = _CellOwner()
+            weakref.finalize(owner, self._fold, cell).atexit = False
+            with self._lock:
+                self._cells[id(cell)] = cell
+            self._local.cell = cell
+            self._local.owner = owner
+            return cell
+
+    def totals(self) -> list:
+        with self._lock:
+            totals = list(self._finished)
+            cells = list(self._cells.values())
+        for cell in cells:
+            for i in range(self.size):
+                totals[i] += cell[i]
+        return totals
+
+    def _fold(self, cell: list):
+        with self._lock:
+            del self._cells[id(cell)]
+            self._finished = [a + b for (a, b) in zip(self._finished, cell)]
+
+
+class _CellOwner:
+    __slots__ = ('__weakref__',)
+
+
+class _Metric(abc.ABC):
+    type = None
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), **kwargs):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._kwargs = kwargs
+        self._children = {}
+        self._lock = threading.Lock()
+        self._function = None
+
+    def labels(self, *values) -> '_Metric':
+        """
+        Returns the child metric of the given label values.
+        Children should be kept by the callers in hot paths to avoid the lookup.
+        """
+        if len(values) != len(self.labelnames):
+            raise ValueError('Expected %d label values' % len(self.labelnames))
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, type(self)(self.name, self.documentation, **self._kwargs))
+        return child
+
+    def set_function(self, fn: Callable[[], object]):
+        """
+        Compute the value of the metric on collection.
+        For labelled metrics, the function should return a dict of label values to values.
+        """
+        self._function = fn
+
+    def samples(self) -> Iterable[Tuple[str, Dict[str, str], float]]:
+        if self._function is not None:
+            value = self._function()
+            if self.labelnames:
+                for (values, v) in value.items():
+                    values = values if isinstance(values, tuple) else (values,)
+                    yield (self.name, dict(zip(self.labelnames, values)), v)
+            else:
+                yield (self.name, {}, value)
+        elif self.labelnames:
+            for (values, child) in list(self._children.items()):
+                labels = dict(zip(self.labelnames, values))
+                for (name, child_labels, value) in child.samples():
+                    yield (name, dict(labels, **child_labels), value)
+        else:
+            yield from self._own_samples()
+
+    @abc.abstractmethod
+    def _own_samples(self) -> Iterable[Tuple[str, Dict[str, str], float]]:
+        """
+        The samples of a metric without labels.
+        """
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cells = _ShardedCells(1)
+
+    def inc(self, amount=1):
+        self._cells.cell()[0] += amount
+
+    def value(self):
+        return self._cells.totals()[0]
+
+    def _own_samples(self):
+        yield (self.name, {}, self.value())
+
+
+class Gauge(_Metric):
+    """
+    A value that can go up and down.
+    Gauges are usually set from a function on collection, as their updates take a lock.
+    """
+    type = 'gauge'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._value = 0
+
+    def set(self, value):
+        self._value = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def value(self):
+        return self._value
+
+    def _own_samples(self):
+        yield (self.name, {}, self._value)
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames, buckets=buckets)
+        self.buckets = tuple(buckets)
+        # A cell has a count per bucket, the count of the +Inf bucket, the sum and the count
+        self._cells = _ShardedCells(len(self.buckets) + 3)
+
+    def observe(self, value):
+        cell = self._cells.cell()
+        cell[bisect_left(self.buckets, value)] += 1
+        cell[-2] += value
+        cell[-1] += 1
+
+    def timed(self, fn):
+        """
+        Decorator that observes the duration of every call of the decorated function.
+        """
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.observe(time.perf_counter() - start)
+        return wrapper
+
+    def _own_samples(self):
+        totals = self._cells.totals()
+        cumulative = 0
+        for (bound, count) in zip(self.buckets + (float('inf'),), totals):
+            cumulative += count
+            yield (self.name + '_bucket', {'le': _format_value(bound)}, cumulative)
+        yield (self.name + '_sum', {}, totals[-2])
+        yield (self.name + '_count', {}, totals[-1])
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self.metrics:
+                raise ValueError('Duplicated metric %s' % metric.name)
+            self.metrics[metric.name] = metric
+        return metric
+
+    def expose(self) -> str:
+        """
+        Returns the metrics in the Prometheus text format.
+        """
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.append('# HELP %s %s' % (metric.name, metric.documentation))
+            lines.append('# TYPE %s %s' % (metric.name, metric.type))
+            for (name, labels, value) in metric.samples():
+                lines.append('%s%s %s' % (name, _format_labels(labels), _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    escape = lambda v: str(v).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+    return '{%s}' % ','.join('%s="%s"' % (k, escape(v)) for (k, v) in labels.items())
+
+
+def _format_value(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+REGISTRY = Registry()
+
+
+def counter(name, documentation, labelnames=(), registry=REGISTRY) -> Counter:
+    return registry.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name, documentation, labelnames=(), registry=REGISTRY) -> Gauge:
+    return registry.register(Gauge(name, documentation, labelnames))
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY) -> Histogram:
+    return registry.register(Histogram(name, documentation, labelnames, buckets))
@@ -0,0 +1,153 @@
+"""
+Delivery of game events to observers outside of the thread that raised them.
+
+Observers added to a game are notified synchronously by the thread that changed the game,
+so a slow observer delays the move of the player and every other observer. Observers that
+don't have to run before the move returns, like the database writes or the bots, are
+registered with an `ObserverQueue`: the events are put in a queue and delivered by a worker
+thread of the queue, in the order they were raised.
+
+    db_queue = ObserverQueue('db')
+    game.add_observer(save_winner, (GameOver,), queue=db_queue)
+
+A queue can be shared by several observers and games, its events are delivered one at a time.
+Putting an event never waits, as the game is locked meanwhile: once a queue holds `maxsize`
+events, the events over it are counted as overflows and, following the `overflow` policy of
+the queue, either kept (spill) or lost (drop).
+
+Exceptions raised by observers are logged and counted, they don't stop the delivery of the
+event to the other observers.
+"""
+import logging
+import threading
+import time
+import weakref
+from collections import deque
+from typing import Callable, Literal
+
+from metrics import counter, gauge, histogram
+
+_log = logging.getLogger('observers')
+
+OBSERVER_ERRORS = counter('observer_errors_total', 'Exceptions raised by game observers', ['observer'])
+OBSERVER_OVERFLOWS = counter('observer_overflows_total',
+                             'Events put in an observer queue over its size', ['observer'])
+OBSERVER_LAG_SECONDS = histogram('observer_lag_seconds',
+                                 'Time events wait in a queue before they are delivered', ['observer'])
+
+# Queues that are alive, their depth is collected by name
+_queues = weakref.WeakSet()
+gauge('observer_queue_depth', 'Events waiting in the observer queues', ['observer']).set_function(
+    lambda: _depth_by_name())
+
+# Put in a queue to stop its worker
+_CLOSE = object()
+
+
+def call_observer(cb: Callable, ev, name='sync'):
+    """
+    Call an observer with an event, logging and counting its exception if it raises one.
+    """
+    try:
+        cb(ev)
+    except Exception:
+        OBSERVER_ERRORS.labels(name).inc()
+        _log.exception('Observer %s failed handling %s', getattr(cb, '__qualname__', repr(cb)),
+                       type(ev).__name__)
+
+
+class ObserverQueue:
+    """
+    A queue of events and the worker thread that delivers them to their observers.
+
+    The `name` identifies the queue in the metrics, queues of the same kind (eg: the queue of
+    every bot) should share their name. The worker is started with the first event, and
+    stops once the queue is closed and the events before it were delivered.
+
+    Events over `maxsize` are kept with the 'spill' policy, so none is lost but the memory of
+    the queue isn't bounded, and lost with the 'drop' policy. Either way they're counted in
+    observer_overflows_total, which should be alerted on.
+    """
+
+    def __init__(self, name: str, maxsize=1024, overflow: Literal['spill', 'drop'] = 'spill'):
+        if overflow not in ('spill', 'drop'):
+            raise ValueError('Invalid overflow policy')
+        self.name = name
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self._events = deque()
+        self._cond = threading.Condition()
+        self._worker = None
+        self._lock = threading.Lock()
+        self._lag = OBSERVER_LAG_SECONDS.labels(name)
+        self._overflows = OBSERVER_OVERFLOWS.labels(name)
+        _queues.add(self)
+
+    def wrap(self, cb: Callable) -> Callable:
+        """
+        Returns an observer that puts the events in this queue to be delivered to `cb`.
+        """
+        def enqueue(ev):
+            self.put(cb, ev)
+        enqueue.__qualname__ = getattr(cb, '__qualname__', repr(cb))
+        return enqueue
+
+    def put(self, cb: Callable, ev):
+        """
+        Put an event to be delivered to `cb`, without waiting for room in the queue.
+        """
+        if self._worker is None:
+            self._start()
+        with self._cond:
+            if len(self._events) >= self.maxsize:
+                self._overflows.inc()
+                if len(self._events) == self.maxsize:
+                    _log.warning('Observer queue %s is over its size of %d events', self.name, self.maxsize)
+                if self.overflow == 'drop':
+                    return
+            self._events.append((cb, ev, time.perf_counter()))
+            self._cond.notify()
+
+    def close(self, *_):
+        """
+        Stop the worker once the events already in the queue are delivered.
+        Accepts and ignores an event, so it can be added as an observer (eg: of GameOver).
+        """
+        if self._worker is not None:
+            with self._cond:
+                self._events.append((None, _CLOSE, None))
+                self._cond.notify()
+
+    def join(self, timeout=None):
+        """
+        Wait for the worker to stop, it should be closed first.
+        """
+        if self._worker is not None:
+            self._worker.join(timeout)
+
+    def qsize(self) -> int:
+        return len(self._events)
+
+    def _start(self):
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name='observer-%s' % self.name, daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._events:
+                    self._cond.wait()
+                (cb, ev, enqueued) = self._events.popleft()
+            if ev is _CLOSE:
+                return
+            self._lag.observe(time.perf_counter() - enqueued)
+            call_observer(cb, ev, self.name)
+
+
+def _depth_by_name() -> dict:
+    depths = {}
+    for q in list(_queues):
+        depths[q.name] = depths.get(q.name, 0) + q.qsize()
+    return depths
@@ -0,0 +1,129 @@
+"""
+Pre-fork server mode.
+
+The master process imports the app, which loads the read-only data once: the engine tables of
+sidestacker (the winning windows and the Zobrist keys), the database schema and the frontend
+assets. The objects loaded are then moved out of the garbage collector with `gc.freeze()` and
+the workers are forked, so they share those pages copy-on-write instead of loading them again.
+Nothing opens a database connection or starts a thread before the fork, each worker opens its
+own connections and starts its matchmaker.
+
+Games live in the memory of the worker that created them. Worker N listens on `port + N` and
+its game ids start with 'N-', so a reverse proxy has to send /api/game/N-... to `port + N`,
+while any other path is balanced across the workers, eg: for two workers with nginx
+
+    upstream workers {
+        server 127.0.0.1:5000;
+        server 127.0.0.1:5001;
+    }
+    map $uri $game_worker {
+        ~^/api/game/0-  127.0.0.1:5000;
+        ~^/api/game/1-  127.0.0.1:5001;
+    }
+    # In the server block, along with the WebSocket upgrade headers
+    location ~ ^/api/game/[0-9]+- {
+        proxy_pass http://$game_worker;
+    }
+    location / {
+        proxy_pass http://workers;
+    }
+
+Players waiting for a match are only paired with players of the same worker, and /metrics
+reports the worker that answers it.
+
+Usage:
+    python prefork.py --workers 4 --port 5000
+"""
+import argparse
+import gc
+import importlib
+import os
+import signal
+import socket
+import sys
+
+from werkzeug.serving import make_server
+
+
+def bind(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(128)
+    return sock
+
+
+def run_worker(application, index: int, sock: socket.socket):
+    application.game_connection_handler.id_prefix = '%d-' % index
+    application.matchmaker.start()
+    (host, port) = sock.getsockname()
+    server = make_server(host, port, application.app, threaded=True, fd=sock.fileno())
+    server.serve_forever()
+
+
+def spawn(application, index: int, sockets) -> int:
+    pid = os.fork()
+    if pid != 0:
+        return pid
+
+    # Worker
+    status = 1
+    try:
+        gc.enable()
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        for (i, sock) in enumerate(sockets):
+            if i != index:
+                sock.close()
+        run_worker(application, index, sockets[index])
+        status = 0
+    finally:
+        os._exit(status)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve sidestacker from pre-forked worker processes')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000, help='Port of the first worker')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args(argv)
+
+    # Objects allocated from here are shared with the workers, collections would write to them
+    gc.disable()
+    application = importlib.import_module('app')
+    sockets = [bind(args.host, args.port + i) for i in range(args.workers)]
+    gc.freeze()
+
+    workers = {}
+    stopping = []
+
+    def stop(signum, frame):
+        stopping.append(signum)
+        for pid in workers:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for i in range(args.workers):
+        workers[spawn(application, i, sockets)] = i
+        print('Worker %d listening on %s:%d' % (i, args.host, args.port + i), file=sys.stderr)
+
+    while workers:
+        try:
+            (pid, status) = os.wait()
+        except ChildProcessError:
+            break
+        index = workers.pop(pid, None)
+        if index is None or stopping:
+            continue
+        # Games of a worker are lost with it, restart it so its port keeps answering
+        print('Worker %d exited with status %d, restarting it' % (index, os.waitstatus_to_exitcode(status)),
+              file=sys.stderr)
+        workers[spawn(application, index, sockets)] = index
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,116 @@
+"""
+On demand diagnostics of a running worker.
+
+The sampling profiler periodically captures the stacks of every thread during a time window
+and aggregates them in the collapsed format used by flame graph tools (eg: flamegraph.pl,
+speedscope): one line per distinct stack, with its frames separated by ';' followed by the
+amount of samples.
+
+Game traces record the duration of every observer notification, bot decision and database
+statement of a single game. While no game is traced the instrumented code only checks
+whether the `TRACES` dict is empty.
+"""
+import sys
+import threading
+import time
+from collections import Counter
+from functools import wraps
+from typing import Dict, Optional
+
+_profiler_lock = threading.Lock()
+
+
+def sample_stacks(duration: float, interval=0.005) -> Optional[Counter]:
+    """
+    Samples the stacks of every other thread for `duration` seconds.
+    Returns a Counter of collapsed stacks, or None if another profile is running.
+    """
+    if not _profiler_lock.acquire(blocking=False):
+        return None
+
+    try:
+        stacks = Counter()
+        own_id = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        end = time.monotonic() + duration
+        while time.monotonic() < end:
+            for (thread_id, frame) in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append('%s (%s:%d)' % (code.co_name, code.co_filename, code.co_firstlineno))
+                    frame = frame.f_back
+                frames.append(names.get(thread_id, 'thread-%d' % thread_id))
+                stacks[';'.join(reversed(frames))] += 1
+            time.sleep(interval)
+        return stacks
+    finally:
+        _profiler_lock.release()
+
+
+def collapsed(stacks: Counter) -> str:
+    return ''.join('%s %d\n' % (stack, count) for (stack, count) in stacks.most_common())
+
+
+class GameTrace:
+    """
+    The spans recorded for a game, up to `max_spans` of them.
+    Each span is a tuple of (kind, name, start, duration) where start is relative to the
+    start of the trace and both are in seconds.
+    """
+
+    def __init__(self, game_id: str, max_spans=10000):
+        self.game_id = game_id
+        self.max_spans = max_spans
+        self.started = time.perf_counter()
+        self.spans = []
+        self.dropped = 0
+
+    def record(self, kind: str, name: str, start: float, duration: float):
+        if len(self.spans) >= self.max_spans:
+            self.dropped += 1
+            return
+        self.spans.append((kind, name, start - self.started, duration))
+
+    def to_dict(self) -> dict:
+        return {
+            'game_id': self.game_id,
+            'dropped': self.dropped,
+            'spans': [{'kind': k, 'name': n, 'start': s, 'duration': d} for (k, n, s, d) in self.spans]
+        }
+
+
+# Traces of the games being traced, indexed by game id
+TRACES: Dict[str, GameTrace] = {}
+
+
+def start_trace(game_id: str, max_spans=10000) -> GameTrace:
+    trace = GameTrace(game_id, max_spans)
+    TRACES[game_id] = trace
+    return trace
+
+
+def stop_trace(game_id: str) -> Optional[GameTrace]:
+    return TRACES.pop(game_id, None)
+
+
+def traced(kind: str, name: str):
+    """
+    Decorator of methods that receive the game id as their first argument, the calls for
+    traced games are recorded.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(self, game_id, *args, **kwargs):
+            trace = TRACES.get(game_id) if TRACES else None
+            if trace is None:
+                return fn(self, game_id, *args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(self, game_id, *args, **kwargs)
+            finally:
+                trace.record(kind, name, start, time.perf_counter() - start)
+        return wrapper
+    return decorator
@@ -0,0 +1,82 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenBucket:
+    """
+    This class implements a token bucket rate limiter.
+
+    The bucket holds up to `burst` tokens and is refilled with `rate` tokens per second.
+    Each admitted message consumes a token, when there are no tokens left the message
+    should be throttled.
+    """
+
+    def __init__(self, rate: float, burst: float, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self._clock = clock
+        self._last = clock()
+        self._lock = threading.Lock()
+
+    def consume(self, tokens=1) -> bool:
+        """
+        Consumes the given tokens if they are available, returns whether they were.
+        """
+        with self._lock:
+            self._refill()
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return True
+            return False
+
+    def wait_time(self, tokens=1) -> float:
+        """
+        Returns the seconds until the given tokens are available.
+        """
+        with self._lock:
+            self._refill()
+            return max(0.0, (tokens - self.tokens) / self.rate)
+
+    def _refill(self):
+        now = self._clock()
+        self.tokens = min(self.burst, self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+
+class RateLimiter:
+    """
+    This class keeps a token bucket for each key (eg: the ip address of a client).
+
+    Only the `max_keys` most recently used buckets are kept, so the memory used is bounded
+    regardless of the amount of clients. A client whose bucket is evicted starts with a full bucket.
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, key, tokens=1) -> bool:
+        return self._bucket(key).consume(tokens)
+
+    def wait_time(self, key, tokens=1) -> float:
+        """
+        Returns the seconds until the given tokens are available for the key.
+        """
+        return self._bucket(key).wait_time(tokens)
+
+    def _bucket(self, key) -> TokenBucket:
+        with self._lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(self.rate, self.burst)
+                self.buckets[key] = bucket
+                if len(self.buckets) > self.max_keys:
+                    self.buckets.popitem(last=False)
+            else:
+                self.buckets.move_to_end(key)
+            return bucket
@@ -0,0 +1,189 @@
+"""
+Headless bot-vs-bot simulator.
+
+Games are played by wiring a SideStacker instance to two bots, without Flask or WebSockets,
+across a pool of processes. Reports the throughput of the simulation, the win and draw rates
+of each strategy and the time the bots take to decide their moves.
+
+Usage:
+    python selfplay.py --games 10000 --workers 4 --strategies greedy,random
+    python selfplay.py --games 1000 --db selfplay.sqlite
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from bot import Bot
+from db_handler import DBHandler
+from events import GameOver, PiecePlaced
+from sidestacker import SideStacker
+
+# Seats of the players by their turn
+SEATS = ('first', 'second')
+
+
+class TimedBot(Bot):
+    """
+    A bot that records the time it takes to choose each move.
+    """
+
+    def __init__(self, *args, move_times, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.move_times = move_times
+
+    def choose_move(self):
+        start = time.perf_counter()
+        move = super().choose_move()
+        self.move_times.append(time.perf_counter() - start)
+        return move
+
+
+def play_game(strategies, move_times, record_moves=False):
+    """
+    Play a game between two bots with the given strategies.
+    Returns a tuple of (game_id, winning seat and strategy or None on a tie, winning piece, moves),
+    the seat is 'first' or 'second' by the turn of the bot.
+    """
+    ss = SideStacker(str(uuid.uuid4()))
+    result = {}
+    moves = []
+
+    def observer(ev):
+        if isinstance(ev, GameOver):
+            result['winner'] = ev.winner
+        elif record_moves and isinstance(ev, PiecePlaced):
+            moves.append((ev.row, ev.side, ev.player, ev.turn))
+
+    ss.add_observer(observer)
+    # Bots place pieces of their own turn while being notified, the game is played
+    # as soon as the second bot connects.
+    bots = []
+    for (i, strategy) in enumerate(strategies):
+        bot = TimedBot(ss, 'bot%d' % i, start_delay=0, strategy=strategy, move_times=move_times)
+        bot.observe()
+        bots.append(bot)
+    for bot in bots:
+        ss.connect(bot.player_id)
+
+    winner = result.get('winner')
+    winning_seat = next((SEATS[b.turn], b.strategy) for b in bots if b.player_piece == winner) \
+        if winner is not None else None
+    return ss.id, winning_seat, winner, moves
+
+
+def play_games(count, strategies, seed, record_moves=False):
+    """
+    Play several games, this is the unit of work of each process.
+    """
+    random.seed(seed)
+    move_times = []
+    wins = Counter()
+    games = []
+    start = time.perf_counter()
+    for _ in range(count):
+        (game_id, winning_seat, winner, game_moves) = play_game(strategies, move_times, record_moves)
+        wins[winning_seat] += 1
+        if record_moves:
+            games.append((game_id, 'tie' if winner is None else winner, game_moves))
+    return {
+        'games': count,
+        'moves': len(move_times),
+        'wins': dict(wins),
+        'move_times': move_times,
+        'elapsed': time.perf_counter() - start,
+        'records': games
+    }
+
+
+def win_rates(wins: Counter, games: int) -> dict:
+    """
+    Win rates by seat, then by strategy, and the draw rate.
+    """
+    rates = {seat: {} for seat in SEATS}
+    rates['draw'] = wins.get(None, 0) / games
+    for (seat, n) in wins.items():
+        if seat is not None:
+            rates[seat[0]][seat[1]] = n / games
+    return rates
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def simulate(games, strategies, workers, chunk_size=100, seed=None, db_file=None):
+    seed = random.randrange(2 ** 32) if seed is None else seed
+    chunks = [min(chunk_size, games - i) for i in range(0, games, chunk_size)]
+    record_moves = db_file is not None
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        partials = list(executor.map(play_games,
+                                     chunks,
+                                     [strategies] * len(chunks),
+                                     [seed + i for i in range(len(chunks))],
+                                     [record_moves] * len(chunks)))
+    elapsed = time.perf_counter() - start
+
+    wins = Counter()
+    move_times = []
+    moves = 0
+    for partial in partials:
+        wins.update(partial['wins'])
+        move_times.extend(partial['move_times'])
+        moves += partial['moves']
+    move_times.sort()
+
+    if db_file is not None:
+        db = DBHandler(db_file)
+        for partial in partials:
+            db.save_games(partial['records'])
+
+    return {
+        'games': games,
+        'workers': workers,
+        'seed': seed,
+        'elapsed': elapsed,
+        'games_per_second': games / elapsed,
+        'moves_per_second': moves / elapsed,
+        'win_rates': win_rates(wins, games),
+        'move_time_ms': {
+            'p50': percentile(move_times, 50) * 1000,
+            'p95': percentile(move_times, 95) * 1000,
+            'p99': percentile(move_times, 99) * 1000,
+            'max': move_times[-1] * 1000
+        } if move_times else None
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Play bot-vs-bot sidestacker games')
+    parser.add_argument('--games', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--strategies', default='greedy,greedy',
+                        help='Comma separated strategies of both bots, one of: %s' % ', '.join(Bot.STRATEGIES))
+    parser.add_argument('--chunk-size', type=int, default=100, help='Games played per task')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--db', help='Save the games to this sqlite database')
+    args = parser.parse_args(argv)
+
+    strategies = args.strategies.split(',')
+    if len(strategies) != 2 or any(s not in Bot.STRATEGIES for s in strategies):
+        parser.error('Two strategies are required, one of: %s' % ', '.join(Bot.STRATEGIES))
+
+    report = simulate(args.games, strategies, args.workers, args.chunk_size, args.seed, args.db)
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,10 +1,129 @@
 import random
+import threading
+import time
 import uuid
 
+from collections import deque
+from functools import wraps
 from itertools import repeat
-from typing import Tuple, Callable
+from typing import Tuple, Callable, Iterable, List
 
 from events import *
+from metrics import counter, histogram
+from observers import ObserverQueue, call_observer
+from profiling import TRACES
+
+MOVES = counter('sidestacker_moves_total', 'Pieces placed on the board')
+INVALID_MOVES = counter('sidestacker_invalid_moves_total', 'Rejected piece placements', ['reason'])
+PLACE_PIECE_SECONDS = histogram('sidestacker_place_piece_seconds',
+                                'Time to place a piece, including the synchronous observers')
+_not_started = INVALID_MOVES.labels('not_started')
+_wrong_turn = INVALID_MOVES.labels('wrong_turn')
+_row_full = INVALID_MOVES.labels('row_full')
+_out_of_board = INVALID_MOVES.labels('out_of_board')
+
+
+def synchronized(method):
+    """
+    Run the decorated method holding the lock of the instance.
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+def _zobrist_keys(seed=0x5eed):
+    rnd = random.Random(seed)
+    return tuple(tuple({p: rnd.getrandbits(64) for p in ('X', 'C')} for _ in range(7)) for _ in range(7))
+
+
+def _win_windows():
+    windows = []
+    for row in range(7):
+        for col in range(7):
+            for (dr, dc) in ((0, 1), (1, 0), (1, 1), (1, -1)):
+                if 0 <= row + 3 * dr < 7 and 0 <= col + 3 * dc < 7:
+                    windows.append(tuple((row + i * dr, col + i * dc) for i in range(4)))
+    return tuple(windows)
+
+
+# Random keys of every piece in every position, the hash of a position is the xor of the keys
+# of its pieces, and of ZOBRIST_TURN_KEY when X has the turn. Keys are seeded so every
+# process computes the same hashes.
+ZOBRIST_KEYS = _zobrist_keys()
+ZOBRIST_TURN_KEY = random.Random(0x7e7).getrandbits(64)
+# Every four positions in a row, column or diagonal that win the game
+WIN_WINDOWS = _win_windows()
+
+
+class GameView:
+    """
+    An immutable view of the state of a game, as seen by the bots.
+
+    The board is a tuple of rows, each a tuple of pieces, so views can be shared between
+    threads and kept while the game goes on. `play` returns the view after placing a piece,
+    it only copies the changed row, so it's cheap to explore moves from a view.
+
+    The `key` of a view is the Zobrist hash of its position, views of the same board and
+    player turn have the same key.
+    """
+    __slots__ = ('board', 'turn', 'player_turn', 'is_over', 'version', 'winner', '_legal_moves', '_key')
+
+    def __init__(self, board: Tuple[Tuple[Optional[str], ...], ...], turn: int, player_turn, is_over=False, version=0,
+                 winner=None, key=None):
+        self.board = board
+        self.turn = turn
+        self.player_turn = player_turn
+        self.is_over = is_over
+        self.version = version
+        self.winner = winner
+        self._legal_moves = None
+        self._key = key
+
+    @property
+    def legal_moves(self) -> Tuple[Tuple[Literal['L', 'R'], int, int], ...]:
+        """
+        The (side, row, col) of every piece that can be placed.
+        """
+        if self._legal_moves is None:
+            moves = []
+            if not self.is_over:
+                for row in range(7):
+                    for side in ('L', 'R'):
+                        col = get_next_free_position(self.board, row, side)
+                        if col is not None:
+                            moves.append((side, row, col))
+            self._legal_moves = tuple(moves)
+        return self._legal_moves
+
+    @property
+    def key(self) -> int:
+        if self._key is None:
+            key = ZOBRIST_TURN_KEY if self.player_turn == 'X' else 0
+            for (row, pieces) in enumerate(self.board):
+                for (col, piece) in enumerate(pieces):
+                    if piece is not None:
+                        key ^= ZOBRIST_KEYS[row][col][piece]
+            self._key = key
+        return self._key
+
+    def play(self, row: int, side: Literal['L', 'R']) -> 'GameView':
+        """
+        Returns the view after the player of the turn places a piece, the move should be legal.
+        """
+        col = get_next_free_position(self.board, row, side)
+        piece = self.player_turn
+        changed = self.board[row][:col] + (piece,) + self.board[row][col + 1:]
+        won = evaluate_move(self.board, row, col, piece)
+        return GameView(self.board[:row] + (changed,) + self.board[row + 1:],
+                        self.turn + 1,
+                        'X' if piece == 'C' else 'C',
+                        won or self.turn == 7 * 7 - 1,
+                        self.version + 1,
+                        piece if won else None,
+                        self.key ^ ZOBRIST_KEYS[row][col][piece] ^ ZOBRIST_TURN_KEY)
 
 
 class SideStacker:
@@ -30,6 +149,8 @@ class SideStacker:
         - Current turn
         - Player turn
         - Board state
+        - Version
+        - Winner
     The game id is an unique identifier for this game.
     The players dict stores the currently connected players their id and turn as a tuple.
     The current turn is an integer counter of the current turn.
@@ -39,6 +160,15 @@ class SideStacker:
          - 'C' for circle tokens
          - 'X' for cross tokens
          - None for empty positions
+    The version is a counter that increases on every change of the state, it's used to
+    identify snapshots of the game.
+    The winner is set once the game is over, it stays None on a tie.
+
+    Readers that don't need a copy they can modify, like the bots, get the state from
+    `view`, an immutable view of the game shared until the next change.
+
+    The last placed pieces are kept in a ring buffer, so clients that lost their connection can
+    catch up with the events that happened after the last turn they saw.
 
     Each player can take actions, these can be:
         - Connect: Adds a player to the game and assigns them the circle or cross pieces.
@@ -57,19 +187,36 @@ class SideStacker:
 
     This class also implements the observer pattern to notify other subsystems of
     actions in the game. Each turn the observers are notified of state changes in
-    the board.
+    the board. Observers subscribe to event types, and are only notified of the events
+    of those types.
 
     Each event is an instance of the `SideStackerEvent' class or subclasses.
+
+    Players act from their own connection threads, actions and notifications hold a
+    reentrant lock so the state changes and the events of a game are serialized.
+    Observers that don't need to run within the action can be registered with an
+    `ObserverQueue`, and an exception raised by an observer doesn't reach the others.
     """
 
-    def __init__(self, game_id=str(uuid.uuid4())):
+    def __init__(self, game_id=str(uuid.uuid4()), history_size=7 * 7):
         self.id = game_id
         self.board = [[None] * 7 for _ in range(7)]
         self.players = {}
-        self.dependants = []
+        # Observers indexed by the event types they subscribed to
+        self.dependants = {t: [] for t in EVENT_TYPES}
         self.turn = 0
         self.player_turn = None
-
+        self.version = 0
+        self.is_over = False
+        self.winner = None
+        self.history = deque(maxlen=history_size)
+        self._snapshot = None
+        self._view = None
+        self._pending_events = deque()
+        self._notifying = False
+        self._lock = threading.RLock()
+
+    @synchronized
     def connect(self, player_id: str) -> Optional[Tuple[str, int]]:
         """
         Adds a player to the game with the given id.
@@ -89,37 +236,65 @@ class SideStacker:
             self.turn = 0
             self.player_turn = p1[0] if p1[1] < p2_turn else p2_pieces
 
+        self.version += 1
         self.notify(PlayerConnected(self.id, player_id, *self.players[player_id]))
         self.notify(PlayerInfo(self.id, [{'piece': p, 'turn': t} for (p, t) in self.players.values()]))
 
         return self.players[player_id]
 
+    @synchronized
     def disconnect(self, player_id: str) -> None:
         """
         Disconnects a player.
         Removes player from the players dict and the other player automatically wins the game.
         """
-        pieces = self.players[player_id]
+        pieces = self.players[player_id][0]
         del self.players[player_id]
+        self.version += 1
         self.notify(PlayerDisconnected(self.id, pieces))
-        self.notify(GameOver(self.id, 'X' if pieces == 'C' else 'C'))
+        self._game_over('X' if pieces == 'C' else 'C')
 
-    def place_piece(self, player_id: str, row: int, side: Literal['L', 'R']) -> None:
+    @synchronized
+    def check_turn(self, player_id: str) -> bool:
+        """
+        Check if the player can place a piece, it's notified of a PiecePlacedError otherwise.
+        This lets callers reject a move before they decode it.
+        """
         if len(self.players) < 2:
+            _not_started.inc()
             self.notify(PiecePlacedError(self.id,
                                          player_id,
                                          self.turn,
                                          'There should be two players to start the game'))
-            return
+            return False
 
-        if self.players[player_id][0] != self.player_turn:
+        player = self.players.get(player_id)
+        if player is None or player[0] != self.player_turn:
+            _wrong_turn.inc()
             self.notify(PiecePlacedError(self.id,
                                          player_id,
                                          self.turn,
                                          'Players should place pieces on their own turn'))
+            return False
+
+        return True
+
+    @PLACE_PIECE_SECONDS.timed
+    @synchronized
+    def place_piece(self, player_id: str, row: int, side: Literal['L', 'R']) -> None:
+        if not self.check_turn(player_id):
+            return
+
+        if not is_on_board(row, side):
+            _out_of_board.inc()
+            self.notify(PiecePlacedError(self.id,
+                                         player_id,
+                                         self.turn,
+                                         'The row should be between 0 and 6 and the side L or R'))
             return
 
         if not is_move_legal(self.board, row, side):
+            _row_full.inc()
             self.notify(PiecePlacedError(self.id,
                                          player_id,
                                          self.turn,
@@ -128,27 +303,132 @@ class SideStacker:
 
         col = get_next_free_position(self.board, row, side)
         self.board[row][col] = self.players[player_id][0]
+        self.version += 1
+        MOVES.inc()
         winner = evaluate_move(self.board, row, col, self.player_turn)
 
         if winner:
-            self.notify(GameOver(self.id, self.player_turn))
+            self._game_over(self.player_turn)
             return
-        elif self.turn == 7 * 7:
-            self.notify(GameOver(self.id, None))
+        elif self.turn == 7 * 7 - 1:
+            self._game_over(None)
             return
         else:
             current_turn = self.turn
             current_player = self.player_turn
             self.turn += 1
             self.player_turn = 'X' if self.player_turn == 'C' else 'C'
-            self.notify(PiecePlaced(self.id, current_player, row, side, current_turn))
+            ev = PiecePlaced(self.id, current_player, row, side, current_turn)
+            self.history.append(ev)
+            self.notify(ev)
 
-    def add_observer(self, cb: Callable[[SideStackerEvent], None]):
-        self.dependants.append(cb)
+    def events_since(self, turn: int) -> Optional[List[PiecePlaced]]:
+        """
+        Returns the pieces placed after the given turn.
+        If the history doesn't reach back to the given turn, returns None and a snapshot
+        should be used instead, this is also the case once the game is over.
+        """
+        if self.is_over:
+            return None
+        if turn >= self.turn - 1:
+            return []
+        if len(self.history) == 0 or self.history[0].turn > turn + 1:
+            return None
+        return [ev for ev in self.history if ev.turn > turn]
+
+    @synchronized
+    def snapshot(self) -> dict:
+        """
+        Returns the current state of the game as a json serializable dict.
+        The snapshot is cached until the next change of the state, it shouldn't be modified.
+        """
+        if self._snapshot is None or self._snapshot['version'] != self.version:
+            self._snapshot = {
+                'game_id': self.id,
+                'version': self.version,
+                'board': [list(row) for row in self.board],
+                'turn': self.turn,
+                'player_turn': self.player_turn,
+                'players': [{'piece': p, 'turn': t} for (p, t) in self.players.values()],
+                'is_over': self.is_over,
+                'winner': self.winner
+            }
+        return self._snapshot
+
+    @synchronized
+    def view(self) -> GameView:
+        """
+        Returns an immutable view of the current state of the game.
+        The view is cached until the next change of the state, and shared by its readers.
+        """
+        if self._view is None or self._view.version != self.version:
+            self._view = GameView(tuple(tuple(row) for row in self.board),
+                                  self.turn,
+                                  self.player_turn,
+                                  self.is_over,
+                                  self.version,
+                                  self.winner)
+        return self._view
+
+    def add_observer(self, cb: Callable[[SideStackerEvent], None], event_types: Iterable[type] = EVENT_TYPES,
+                     queue: Optional[ObserverQueue] = None):
+        """
+        Add an observer of the given event types, by default of every event.
+        Observers of a type are notified in the order they were added, the observers of a base
+        type (eg: SideStackerEvent) are also notified of the events of its subclasses.
 
+        Observers are called synchronously by the thread that raised the event, unless a `queue`
+        is given, then the events are delivered by the worker of the queue.
+        """
+        if queue is not None:
+            cb = queue.wrap(cb)
+        for t in event_types:
+            self.dependants.setdefault(t, []).append(cb)
+
+    @synchronized
     def notify(self, ev: SideStackerEvent):
-        for cb in self.dependants:
-            cb(ev)
+        """
+        Notify the observers of an event.
+        Events raised while the observers are being notified (eg: a bot placing a piece
+        in response to a move) are queued and delivered afterwards, so every observer
+        receives the events in the same order they happened.
+        """
+        self._pending_events.append(ev)
+        if self._notifying:
+            return
+
+        self._notifying = True
+        try:
+            while self._pending_events:
+                ev = self._pending_events.popleft()
+                trace = TRACES.get(self.id) if TRACES else None
+                if trace is None:
+                    for cb in self._observers(ev):
+                        call_observer(cb, ev)
+                else:
+                    self._notify_traced(ev, trace)
+        finally:
+            self._notifying = False
+            self._pending_events.clear()
+
+    def _observers(self, ev: SideStackerEvent):
+        for t in type(ev).__mro__:
+            yield from self.dependants.get(t, ())
+
+    def _notify_traced(self, ev: SideStackerEvent, trace):
+        for cb in self._observers(ev):
+            start = time.perf_counter()
+            call_observer(cb, ev)
+            trace.record('notify',
+                         '%s -> %s' % (type(ev).__name__, getattr(cb, '__qualname__', repr(cb))),
+                         start,
+                         time.perf_counter() - start)
+
+    def _game_over(self, winner: Optional[Literal['X', 'C']]):
+        self.is_over = True
+        self.winner = winner
+        self.version += 1
+        self.notify(GameOver(self.id, winner))
 
 
 def get_next_free_position(board, row, side):
@@ -163,6 +443,13 @@ def get_next_free_position(board, row, side):
     return None
 
 
+def is_on_board(row, side):
+    """
+    Check if the row and side of a move are on the board, they come from the clients as is.
+    """
+    return isinstance(row, int) and not isinstance(row, bool) and 0 <= row < 7 and side in ('L', 'R')
+
+
 def is_move_legal(board, row, side):
     """
     Check if the move is legal.
@@ -0,0 +1,150 @@
+import threading
+from collections import deque
+from typing import Callable, Literal, Optional
+
+SlowConsumerPolicy = Literal['drop', 'coalesce', 'disconnect']
+# Returned from the buffer when a coalescing viewer has to be sent a new snapshot
+_RESYNC = object()
+
+
+class SpectatorChannel:
+    """
+    This class broadcasts the serialized events of a single game to read-only viewers.
+
+    Instead of copying every message into a queue per viewer, the channel keeps a single
+    ring buffer of the last `capacity` messages, each one identified by a sequence number.
+    Every viewer only keeps a cursor into that buffer, which makes its buffer bounded
+    by construction: a viewer can be at most `capacity` messages behind.
+
+    Publishing a message costs the same for one viewer or thousands of them, so the
+    players' move path isn't affected by the amount of spectators of the game.
+
+    Viewers that fall behind the buffer are handled following their policy:
+        - drop: The messages that no longer fit in the buffer are lost, the viewer
+          continues from the oldest message still available.
+        - coalesce: The lost messages are replaced by a fresh snapshot of the game.
+        - disconnect: The viewer is closed.
+
+    New viewers join with a snapshot of the game produced by `snapshot_factory`, followed by
+    the messages published after the snapshot. Messages are expected to be published holding
+    `lock` (eg: the lock of the game), the snapshots are taken holding it as well, so a snapshot
+    and the position of the viewer in the buffer match.
+    """
+
+    def __init__(self, snapshot_factory: Callable[[], str], capacity=64, lock=None):
+        self.snapshot_factory = snapshot_factory
+        self.capacity = capacity
+        self.lock = threading.RLock() if lock is None else lock
+        self.messages = deque(maxlen=capacity)
+        # Sequence number of the next message to be published
+        self.head = 0
+        self.closed = False
+        self.viewers = set()
+        self._cond = threading.Condition()
+
+    def subscribe(self, policy: SlowConsumerPolicy = 'coalesce', max_lag=None) -> 'Spectator':
+        max_lag = self.capacity if max_lag is None else min(max_lag, self.capacity)
+        with self.lock:
+            snapshot = self.snapshot_factory()
+            with self._cond:
+                viewer = Spectator(self, policy, max_lag, self.head, snapshot)
+                self.viewers.add(viewer)
+        return viewer
+
+    def unsubscribe(self, viewer: 'Spectator'):
+        with self._cond:
+            self.viewers.discard(viewer)
+            viewer.closed = True
+            self._cond.notify_all()
+
+    def publish(self, message: str):
+        with self._cond:
+            if self.closed:
+                return
+            self.messages.append(message)
+            self.head += 1
+            self._cond.notify_all()
+
+    def close(self):
+        """
+        Closes the channel, viewers will receive the pending messages and then be closed.
+        """
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def _next_message(self, viewer: 'Spectator', timeout) -> Optional[str]:
+        message = self._next_buffered_message(viewer, timeout)
+        if message is not _RESYNC:
+            return message
+
+        # The snapshot isn't taken within the condition, as messages are published holding `lock`
+        with self.lock:
+            snapshot = self.snapshot_factory()
+            with self._cond:
+                viewer.cursor = self.head
+        return snapshot
+
+    def _next_buffered_message(self, viewer: 'Spectator', timeout):
+        with self._cond:
+            if viewer.cursor == self.head and not self.closed and not viewer.closed:
+                self._cond.wait(timeout)
+
+            if viewer.closed:
+                return None
+
+            lag = self.head - viewer.cursor
+            if lag > viewer.max_lag:
+                viewer.overflows += 1
+                if viewer.policy == 'disconnect':
+                    self.viewers.discard(viewer)
+                    viewer.closed = True
+                    return None
+                elif viewer.policy == 'drop':
+                    viewer.cursor = self.head - viewer.max_lag
+                    lag = viewer.max_lag
+                else:
+                    return _RESYNC
+
+            if lag == 0:
+                if self.closed:
+                    self.viewers.discard(viewer)
+                    viewer.closed = True
+                return None
+
+            # The oldest message in the buffer has the sequence number `head - len(messages)`
+            message = self.messages[len(self.messages) - lag]
+            viewer.cursor += 1
+            return message
+
+
+class Spectator:
+    """
+    A read-only viewer subscribed to a `SpectatorChannel`.
+
+    The first message received is always a snapshot of the game, taken when it subscribed.
+    """
+
+    def __init__(self, channel: SpectatorChannel, policy: SlowConsumerPolicy, max_lag: int, cursor: int,
+                 snapshot: Optional[str] = None):
+        self.channel = channel
+        self.policy = policy
+        self.max_lag = max_lag
+        self.cursor = cursor
+        self.closed = False
+        self.overflows = 0
+        self._snapshot = snapshot
+
+    def next_message(self, timeout=None) -> Optional[str]:
+        """
+        Get the next message for this viewer, waiting up to `timeout` seconds for it.
+        Returns None if there's no message available, check the `closed` attribute to know
+        if more messages can be expected.
+        """
+        if self._snapshot is not None:
+            (snapshot, self._snapshot) = (self._snapshot, None)
+            return snapshot
+        return self.channel._next_message(self, timeout)
+
+    def close(self):
+        self.channel.unsubscribe(self)
@@ -0,0 +1,125 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+from typing import Dict, Optional
+
+from flask import Request, Response, send_file
+
+# Files under this directory have a content hash in their name, they never change
+IMMUTABLE_PREFIX = 'static/'
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+# Appended to the ETag of a file for its gzip variant
+GZIP_ETAG_SUFFIX = '-gz'
+
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'application/xml',
+                      'image/svg+xml', 'application/manifest+json')
+
+
+class Asset:
+    """
+    A file of the frontend build.
+    Small files keep their content in memory along with their compressed variants.
+    """
+    __slots__ = ('path', 'file', 'mimetype', 'etag', 'cache_control', 'size', 'data', 'gzip')
+
+    def __init__(self, path, file, mimetype, etag, cache_control, size, data=None, gzip=None):
+        self.path = path
+        self.file = file
+        self.mimetype = mimetype
+        self.etag = etag
+        self.cache_control = cache_control
+        self.size = size
+        self.data = data
+        self.gzip = gzip
+
+
+class AssetManifest:
+    """
+    This class indexes the files of the frontend build once, so serving them doesn't touch
+    the filesystem for every request.
+
+    Every file gets an ETag from the hash of its content. Files up to `max_memory_size` bytes
+    are kept in memory and, if they are text, precompressed with gzip. Larger files are sent
+    from disk.
+
+    Files with a hashed name get a long lived cache, others have to be revalidated with their
+    ETag, which is answered with a 304 if they didn't change. The gzip variant of a file has
+    its own ETag, and every response of a file with a gzip variant, 304s included, varies on
+    Accept-Encoding.
+    """
+
+    def __init__(self, directory: str, max_memory_size=512 * 1024, min_compress_size=512):
+        self.directory = directory
+        self.max_memory_size = max_memory_size
+        self.min_compress_size = min_compress_size
+        self.assets: Dict[str, Asset] = {}
+        self.load()
+
+    def load(self):
+        assets = {}
+        if os.path.isdir(self.directory):
+            for (root, _, files) in os.walk(self.directory):
+                for name in files:
+                    file = os.path.join(root, name)
+                    path = os.path.relpath(file, self.directory).replace(os.sep, '/')
+                    assets[path] = self._load_asset(path, file)
+        self.assets = assets
+
+    def get(self, path: str) -> Optional[Asset]:
+        return self.assets.get(path)
+
+    def response(self, asset: Asset, request: Request) -> Response:
+        use_gzip = asset.gzip is not None and bool(request.accept_encodings['gzip'])
+        # Each encoding is a different representation, with its own strong ETag
+        etag = asset.etag + GZIP_ETAG_SUFFIX if use_gzip else asset.etag
+        variants = (asset.etag,) if asset.gzip is None else (asset.etag, asset.etag + GZIP_ETAG_SUFFIX)
+        # A client holding either variant has the current content
+        cached = [v for v in (etag,) + variants if request.if_none_match.contains(v)]
+
+        if cached:
+            response = Response(status=304)
+            etag = cached[0]
+        elif asset.data is None:
+            response = send_file(asset.file, mimetype=asset.mimetype, etag=False, conditional=False)
+        elif use_gzip:
+            response = Response(asset.gzip, mimetype=asset.mimetype)
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = Response(asset.data, mimetype=asset.mimetype)
+
+        response.set_etag(etag)
+        if asset.gzip is not None:
+            response.vary.add('Accept-Encoding')
+        response.headers['Cache-Control'] = asset.cache_control
+        return response
+
+    def _load_asset(self, path, file) -> Asset:
+        hasher = hashlib.sha256()
+        data = bytearray()
+        size = 0
+        with open(file, 'rb') as f:
+            for chunk in iter(lambda: f.read(65536), b''):
+                hasher.update(chunk)
+                size += len(chunk)
+                if size <= self.max_memory_size:
+                    data += chunk
+
+        mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        asset = Asset(path,
+                      file,
+                      mimetype,
+                      hasher.hexdigest()[:32],
+                      IMMUTABLE_CACHE_CONTROL if path.startswith(IMMUTABLE_PREFIX) else REVALIDATE_CACHE_CONTROL,
+                      size)
+        if size > self.max_memory_size:
+            return asset
+
+        asset.data = bytes(data)
+        if size >= self.min_compress_size and mimetype.startswith(COMPRESSIBLE_TYPES):
+            compressed = gzip.compress(asset.data, 9, mtime=0)
+            # Only keep variants that are worth it
+            if len(compressed) < size * 0.9:
+                asset.gzip = compressed
+        return asset
@@ -0,0 +1,69 @@
+import os
+from datetime import datetime, timedelta
+from sqlite3 import Connection
+
+from archive import GameArchive, PERIODS
+from db_handler import DBHandler
+
+
+def new_db(tmp_path):
+    db = DBHandler(str(tmp_path / 'hot.sqlite'), archive=GameArchive(str(tmp_path / 'archive')))
+    db.save_games([('old-1', 'X', [(0, 'L', 'X', 0)]),
+                   ('old-2', 'C', [(1, 'R', 'C', 0)]),
+                   ('live', None, [(2, 'L', 'X', 0)]),
+                   ('recent', 'tie', [])])
+    with Connection(db.file) as con:
+        con.execute("update game set game_start = '2024-05-10 12:00:00' where game_id in ('old-1', 'live')")
+        con.execute("update game set game_start = '2024-06-01 00:00:00' where game_id = 'old-2'")
+        con.execute("update game set game_start = '2024-08-01 00:00:00' where game_id = 'recent'")
+    return db
+
+
+def test_old_games_are_moved_to_their_period(tmp_path):
+    db = new_db(tmp_path)
+    moved = db.archive.archive_games(db.file, timedelta(days=30), now=datetime(2024, 8, 15))
+    assert moved == {'2024-05': 2, '2024-06': 1}
+    assert [os.path.basename(f) for f in db.archive.files()] == ['games-2024-06.sqlite', 'games-2024-05.sqlite']
+    with Connection(db.file) as con:
+        assert [r[0] for r in con.execute('select game_id from game')] == ['recent']
+        assert con.execute("select count(*) from game_moves where game_id != 'recent'").fetchone()[0] == 0
+
+
+def test_games_that_arent_over_are_kept_until_abandoned(tmp_path):
+    db = new_db(tmp_path)
+    with Connection(db.file) as con:
+        con.execute("update game set game_start = '2024-08-14 12:00:00' where game_id in ('live', 'recent')")
+    moved = db.archive.archive_games(db.file, timedelta(0), now=datetime(2024, 8, 15))
+    assert moved == {'2024-05': 1, '2024-06': 1, '2024-08': 1}
+    assert db.get_game('recent')['winner'] == 'tie'
+    with Connection(db.file) as con:
+        assert [r[0] for r in con.execute('select game_id from game')] == ['live']
+
+
+def test_games_are_moved_in_batches(tmp_path):
+    db = new_db(tmp_path)
+    db.save_games([('batch-%d' % i, 'X', [(0, 'L', 'X', 0)]) for i in range(5)])
+    with Connection(db.file) as con:
+        con.execute("update game set game_start = '2024-05-20 00:00:00' where game_id like 'batch-%'")
+    moved = db.archive.archive_games(db.file, timedelta(days=30), now=datetime(2024, 8, 15), batch_size=2)
+    assert moved == {'2024-05': 7, '2024-06': 1}
+    assert db.get_game('batch-4')['moves'] == [(0, 'L', 'X', 0)]
+
+
+def test_get_game_reads_archived_games(tmp_path):
+    db = new_db(tmp_path)
+    db.archive.archive_games(db.file, timedelta(days=30), now=datetime(2024, 8, 15))
+    game = db.get_game('old-1')
+    assert game['winner'] == 'X'
+    assert game['moves'] == [(0, 'L', 'X', 0)]
+    assert db.get_game('live')['winner'] is None
+    assert db.get_game('recent')['winner'] == 'tie'
+    assert db.get_game('missing') is None
+
+
+def test_archive_games_by_year(tmp_path):
+    db = new_db(tmp_path)
+    db.archive = GameArchive(str(tmp_path / 'archive'), PERIODS['year'])
+    moved = db.archive.archive_games(db.file, timedelta(days=0), now=datetime(2025, 1, 1), vacuum=True)
+    assert moved == {'2024': 4}
+    assert db.get_game('live')['moves'] == [(2, 'L', 'X', 0)]
@@ -0,0 +1,35 @@
+from benchmark import compare, parse_thresholds, run_benchmark
+
+
+def results(**ns_per_op):
+    return {'results': {name: {'ns_per_op_median': ns} for (name, ns) in ns_per_op.items()}}
+
+
+def test_compare_reports_benchmarks_slower_than_threshold():
+    regressions = compare(results(a=120, b=105), results(a=100, b=100), 0.1, {})
+    assert [r[0] for r in regressions] == ['a']
+
+
+def test_compare_uses_benchmark_threshold():
+    assert compare(results(a=120), results(a=100), 0.1, {'a': 0.5}) == []
+
+
+def test_compare_ignores_benchmarks_missing_in_baseline():
+    assert compare(results(a=500), results(b=100), 0.1, {}) == []
+
+
+def test_parse_thresholds():
+    assert parse_thresholds(['0.2', 'a=0.5']) == (0.2, {'a': 0.5})
+
+
+def test_run_benchmark_cleans_up_generator_setups():
+    events = []
+
+    def setup():
+        events.append('setup')
+        yield lambda: None
+        events.append('cleanup')
+
+    result = run_benchmark(setup, 10, repeat=2)
+    assert events == ['setup', 'cleanup']
+    assert result['number'] == 10
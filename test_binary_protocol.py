@@ -0,0 +1,38 @@
+import pytest
+
+from binary_protocol import decode_piece_placement, encode_piece_placement, encode_event, PIECE_PLACED, GAME_OVER, \
+    PLAYER_INFO
+from events import PiecePlaced, GameOver, PlayerInfo
+
+
+def test_piece_placement_round_trip():
+    for row in range(7):
+        for side in ('L', 'R'):
+            assert decode_piece_placement(encode_piece_placement(row, side)) == (row, side)
+
+
+def test_decode_malformed_piece_placement_raises():
+    with pytest.raises(ValueError):
+        decode_piece_placement(b'\x01')
+    with pytest.raises(ValueError):
+        decode_piece_placement(b'\x02\x00')
+
+
+def test_decode_piece_placement_out_of_the_board_raises():
+    with pytest.raises(ValueError):
+        decode_piece_placement(bytes([0x01, 0xFE]))
+    with pytest.raises(ValueError):
+        decode_piece_placement(encode_piece_placement(7, 'L'))
+
+
+def test_encode_piece_placed():
+    assert encode_event(PiecePlaced('id', 'C', 3, 'R', 12)) == bytes([PIECE_PLACED, 2, 3 << 1 | 1, 12])
+
+
+def test_encode_tie():
+    assert encode_event(GameOver('id', None)) == bytes([GAME_OVER, 0])
+
+
+def test_encode_player_info():
+    ev = PlayerInfo('id', [{'piece': 'X', 'turn': 1}, {'piece': 'C', 'turn': 0}])
+    assert encode_event(ev) == bytes([PLAYER_INFO, 2, 1, 1, 2, 0])
@@ -1,8 +1,14 @@
+import random
+import time
+
 from bot import Bot
+from events import GameOver, PiecePlaced, PlayerInfo
+from observers import ObserverQueue
+from sidestacker import SideStacker
 
 def test_get_first_and_last_free_index_on_empty_board():
 
-    b = Bot(None, 'player_id')
+    b = Bot(SideStacker(), 'player_id')
     expected = [
         ('L', 0, 0),
         ('L', 1, 0),
@@ -58,3 +64,101 @@ def test_should_return_blocking_move():
     bm = b.get_blocking_moves(am)
     assert ('L', 0) in bm
 
+
+
+def test_bot_vs_bot_games_end_with_a_single_game_over():
+    for seed in range(50):
+        random.seed(seed)
+        ss = SideStacker('game_id')
+        game_overs = []
+        ss.add_observer(game_overs.append, (GameOver,))
+        for player_id in ('a', 'b'):
+            bot = Bot(ss, player_id, start_delay=0)
+            bot.observe()
+        ss.connect('a')
+        ss.connect('b')
+        assert len(game_overs) == 1
+
+
+def test_bots_with_queues_play_from_their_workers():
+    ss = SideStacker('game_id')
+    game_overs = []
+    ss.add_observer(game_overs.append, (GameOver,))
+    queues = [ObserverQueue('bot'), ObserverQueue('bot')]
+    for (player_id, queue) in zip(('a', 'b'), queues):
+        Bot(ss, player_id, start_delay=0).observe(queue)
+    ss.connect('a')
+    ss.connect('b')
+    for queue in queues:
+        queue.join(5)
+    assert len(game_overs) == 1
+
+
+def test_random_strategy_doesnt_look_for_winning_moves():
+    b = [['C', 'C', 'C', None, None, None, None]] + [[None] * 7 for _ in range(6)]
+
+    class Game:
+        def place_piece(self, player_id, row, side):
+            self.move = (row, side)
+
+    game = Game()
+    bot = Bot(game, 'player_id', b, strategy='random')
+    bot.player_piece = 'C'
+    moves = set()
+    for seed in range(30):
+        random.seed(seed)
+        bot.do_move()
+        moves.add(game.move)
+    assert len(moves) > 1
+
+
+class RecordingGame:
+    id = 'game_id'
+
+    def __init__(self):
+        self.moves = []
+
+    def place_piece(self, player_id, row, side):
+        self.moves.append((player_id, row, side))
+
+
+def test_bot_ignores_connections_of_other_players():
+    ss = SideStacker('game_id')
+    bot = Bot(ss, 'bot', start_delay=0)
+    bot.observe()
+    ss.connect('player')
+    assert bot.player_piece is None
+    ss.connect('bot')
+    assert bot.player_piece == ss.players['bot'][0]
+    assert bot.turn == ss.players['bot'][1]
+
+
+def test_bot_waits_for_the_second_player_to_move_first():
+    game = RecordingGame()
+    bot = Bot(game, 'bot', [[None] * 7 for _ in range(7)], start_delay=0)
+    bot.player_piece = 'X'
+    bot.turn = 0
+    bot._handle_player_info(PlayerInfo(game.id, [{'piece': 'X', 'turn': 0}]))
+    assert game.moves == []
+    bot._handle_player_info(PlayerInfo(game.id, [{'piece': 'X', 'turn': 0}, {'piece': 'C', 'turn': 1}]))
+    assert len(game.moves) == 1
+
+
+def test_first_move_delay_doesnt_hold_the_game():
+    # The bot is first to move with this seed
+    random.seed(1)
+    ss = SideStacker('game_id')
+    bot = Bot(ss, 'bot', start_delay=0.2)
+    bot.observe()
+    moves = []
+    ss.add_observer(moves.append, (PiecePlaced,))
+    ss.connect('bot')
+    start = time.monotonic()
+    ss.connect('player')
+    assert time.monotonic() - start < 0.1
+    assert moves == []
+    for _ in range(100):
+        if moves:
+            break
+        time.sleep(0.01)
+    assert moves[0].player == bot.player_piece
@@ -1,3 +1,7 @@
+import threading
+import time
+from json import loads
+
 from connection_handler import GameConnectionHandler
 from sidestacker import SideStacker
 
@@ -10,6 +14,25 @@ def test_new_game_adds_new_game():
     assert game == gch.games[game.id]['game']
 
 
+def test_game_ids_start_with_the_id_prefix():
+    gch = GameConnectionHandler(pool_size=1, id_prefix='3-')
+    gch.prewarm()
+    assert gch.new_game().id.startswith('3-')
+    assert gch.new_game().id.startswith('3-')
+
+
+def test_pool_is_filled_again_in_the_background():
+    gch = GameConnectionHandler(pool_size=4)
+    gch.prewarm()
+    for _ in range(3):
+        gch.new_game()
+    for _ in range(100):
+        if len(gch._pool) == 4:
+            break
+        time.sleep(0.01)
+    assert len(gch._pool) == 4
+
+
 def test_has_game_for_existant_game():
     gch = GameConnectionHandler()
     game = gch.new_game()
@@ -19,3 +42,147 @@ def test_has_game_for_existant_game():
 def test_has_game_for_unexistant_game():
     gch = GameConnectionHandler()
     assert gch.has_game('test') == False
+
+
+def test_spectator_receives_snapshot_and_game_events():
+    gch = GameConnectionHandler()
+    game = gch.new_game()
+    spectator = gch.add_spectator(game.id)
+    gch.add_connection(game.id, FakeWebSocket(), 'abc')
+    snapshot = loads(spectator.next_message(0))
+    assert snapshot['type'] == 'snapshot'
+    assert snapshot['game_id'] == game.id
+    assert loads(spectator.next_message(0))['type'] == 'player_info'
+
+
+def test_reconnected_player_receives_missed_pieces():
+    gch = GameConnectionHandler(reconnect_grace=60)
+    game = gch.new_game()
+    gch.add_connection(game.id, FakeWebSocket(), 'abc')
+    gch.add_connection(game.id, FakeWebSocket(), 'xyz')
+    first = 'abc' if game.players['abc'][0] == game.player_turn else 'xyz'
+    second = 'xyz' if first == 'abc' else 'abc'
+
+    game.place_piece(first, 0, 'L')
+    gch.close_connection(game.id, second)
+    assert not game.is_over
+    game.place_piece(second, 1, 'L')
+    game.place_piece(first, 2, 'L')
+
+    ws = FakeWebSocket()
+    gch.reconnect(game.id, ws, second, last_turn=0)
+    messages = [loads(m) for m in ws.sent]
+    assert messages[0]['type'] == 'connection'
+    assert messages[0]['player_id'] == second
+    assert [(m['type'], m['turn']) for m in messages[1:]] == [('piece_placed', 1), ('piece_placed', 2)]
+
+
+def test_moves_made_while_a_player_reconnects_are_sent_after_the_missed_ones():
+    gch = GameConnectionHandler(reconnect_grace=60)
+    game = gch.new_game()
+    gch.add_connection(game.id, FakeWebSocket(), 'abc')
+    gch.add_connection(game.id, FakeWebSocket(), 'xyz')
+    first = 'abc' if game.players['abc'][0] == game.player_turn else 'xyz'
+    second = 'xyz' if first == 'abc' else 'abc'
+    game.place_piece(first, 0, 'L')
+    gch.close_connection(game.id, second)
+
+    moves = []
+
+    class SlowWebSocket(FakeWebSocket):
+        def send(self, data):
+            if not moves:
+                # A move arrives while the reconnection is being sent
+                moves.append(threading.Thread(target=game.place_piece, args=(second, 1, 'L')))
+                moves[0].start()
+                time.sleep(0.05)
+            super().send(data)
+
+    ws = SlowWebSocket()
+    gch.reconnect(game.id, ws, second, last_turn=-1)
+    moves[0].join()
+    messages = [loads(m) for m in ws.sent]
+    assert messages[0]['type'] == 'connection'
+    assert [m['turn'] for m in messages[1:]] == [0, 1]
+
+
+def test_reconnected_player_without_last_turn_receives_snapshot():
+    gch = GameConnectionHandler(reconnect_grace=60)
+    game = gch.new_game()
+    gch.add_connection(game.id, FakeWebSocket(), 'abc')
+    gch.close_connection(game.id, 'abc')
+    ws = FakeWebSocket()
+    gch.reconnect(game.id, ws, 'abc')
+    assert loads(ws.sent[-1])['type'] == 'snapshot'
+
+
+def test_lost_connection_without_grace_ends_game():
+    gch = GameConnectionHandler(reconnect_grace=0)
+    game = gch.new_game()
+    gch.add_connection(game.id, FakeWebSocket(), 'abc')
+    gch.add_connection(game.id, FakeWebSocket(), 'xyz')
+    gch.close_connection(game.id, 'abc')
+    assert game.is_over
+    assert game.winner == game.players['xyz'][0]
+
+
+def test_out_of_turn_messages_are_answered_without_parsing():
+    gch = GameConnectionHandler()
+    game = gch.new_game()
+    sockets = {'abc': FakeWebSocket(), 'xyz': FakeWebSocket()}
+    gch.add_connection(game.id, sockets['abc'], 'abc')
+    gch.add_connection(game.id, sockets['xyz'], 'xyz')
+    waiting = 'abc' if game.players['abc'][0] != game.player_turn else 'xyz'
+    sent = len(sockets[waiting].sent)
+    gch.handle_client_message(game.id, waiting, 'not json')
+    assert [loads(m)['type'] for m in sockets[waiting].sent[sent:]] == ['piece_placed_error']
+    assert game.turn == 0
+
+
+def test_moves_before_the_game_starts_are_answered_with_an_error():
+    gch = GameConnectionHandler()
+    game = gch.new_game()
+    ws = FakeWebSocket()
+    gch.add_connection(game.id, ws, 'abc')
+    sent = len(ws.sent)
+    gch.handle_client_message(game.id, 'abc', 'not json')
+    assert [loads(m)['type'] for m in ws.sent[sent:]] == ['piece_placed_error']
+
+
+def test_invalid_json_messages_are_answered_or_dropped():
+    gch = GameConnectionHandler()
+    game = gch.new_game()
+    sockets = {'abc': FakeWebSocket(), 'xyz': FakeWebSocket()}
+    gch.add_connection(game.id, sockets['abc'], 'abc')
+    gch.add_connection(game.id, sockets['xyz'], 'xyz', binary=True)
+    player = 'abc' if game.players['abc'][0] == game.player_turn else 'xyz'
+    for message in ('not json', '[1]', '{"type": "piece-placement"}',
+                    '{"type": "piece-placement", "row": -1, "side": "L"}',
+                    '{"type": "piece-placement", "row": 7, "side": "L"}',
+                    '{"type": "piece-placement", "row": 0, "side": "X"}'):
+        gch.handle_client_message(game.id, player, message)
+    assert game.turn == 0
+    assert game.board == [[None] * 7 for _ in range(7)]
+    assert len(game.history) == 0
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, data):
+        self.sent.append(data)
+
+    def close(self):
+        pass
+
+
+def test_binary_player_receives_binary_messages():
+    gch = GameConnectionHandler()
+    game = gch.new_game()
+    json_ws = FakeWebSocket()
+    binary_ws = FakeWebSocket()
+    gch.add_connection(game.id, json_ws, 'abc')
+    gch.add_connection(game.id, binary_ws, 'xyz', binary=True)
+    assert all(isinstance(m, str) for m in json_ws.sent)
+    assert all(isinstance(m, bytes) for m in binary_ws.sent)
@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+from db_handler import BUSY_TIMEOUT, DBHandler
+from sidestacker import SideStacker
+
+
+def test_database_is_opened_with_the_first_statement(tmp_path):
+    db = DBHandler(str(tmp_path / 'db.sqlite'))
+    assert not os.path.exists(db.file)
+    db.create_game('abc')
+    db.add_move('abc', 0, 'L', 'X', 0)
+    db.save_winner('abc', 'X')
+    game = db.get_game('abc')
+    assert game['winner'] == 'X'
+    assert game['moves'] == [(0, 'L', 'X', 0)]
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='Requires os.fork')
+def test_connections_opened_by_another_process_are_not_reused(tmp_path):
+    db = DBHandler(str(tmp_path / 'db.sqlite'))
+    con = db.connection()
+    assert db.connection() is con
+
+    pid = os.fork()
+    if pid == 0:
+        # Forked worker, reports through its exit status
+        status = 1
+        try:
+            child_con = db.connection()
+            child_con.execute('insert into game(game_id) values (?)', ('child',))
+            child_con.commit()
+            status = 0 if child_con is not con else 2
+        finally:
+            os._exit(status)
+
+    (_, status) = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+    assert db.connection() is con
+    assert db.get_game('child') is not None
+
+
+def test_writers_wait_for_the_lock_of_the_database(tmp_path):
+    db = DBHandler(str(tmp_path / 'db.sqlite'))
+    assert db.connection().execute('pragma busy_timeout').fetchone()[0] == BUSY_TIMEOUT * 1000
+
+
+def test_manage_games_accepts_a_generator(tmp_path):
+    db = DBHandler(str(tmp_path / 'db.sqlite'))
+    db.manage_games(SideStacker(game_id) for game_id in ('abc', 'xyz'))
+    assert db.get_game('abc') is not None
+    assert db.get_game('xyz') is not None
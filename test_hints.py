@@ -0,0 +1,105 @@
+import threading
+
+import pytest
+
+from hints import HintService
+from sidestacker import GameView
+
+ALMOST_WON = tuple(map(tuple, [['C', 'C', 'C', None, None, None, None]] + [[None] * 7 for _ in range(6)]))
+
+
+def test_hint_plays_the_winning_move():
+    hint = HintService().hint(GameView(ALMOST_WON, 3, 'C'), 1000)
+    assert (hint['side'], hint['row']) == ('L', 0)
+    assert hint['score'] > 0.9
+
+
+def test_hint_blocks_the_winning_move_of_the_other_player():
+    hint = HintService().hint(GameView(ALMOST_WON, 3, 'X'), 2000)
+    assert (hint['side'], hint['row']) == ('L', 0)
+
+
+def test_hints_are_cached_by_position():
+    service = HintService()
+    hint = service.hint(GameView(ALMOST_WON, 3, 'C'), 1000)
+    # The same position reached as a different view
+    assert service.hint(GameView(ALMOST_WON, 3, 'C', version=5), 1000) is hint
+    # Answered by the search of a larger budget
+    assert service.hint(GameView(ALMOST_WON, 3, 'C'), 500) is hint
+    larger = service.hint(GameView(ALMOST_WON, 3, 'C'), 2000)
+    assert larger is not hint
+    assert service.hint(GameView(ALMOST_WON, 3, 'C'), 1000) is larger
+
+
+def test_cache_evicts_least_recently_used_positions():
+    service = HintService(max_entries=1)
+    view = GameView(ALMOST_WON, 3, 'C')
+    hint = service.hint(view, 100)
+    service.hint(GameView(ALMOST_WON, 3, 'X'), 100)
+    assert service.hint(view, 100) is not hint
+
+
+def test_concurrent_requests_of_a_position_share_one_search(monkeypatch):
+    service = HintService()
+    started = threading.Event()
+    release = threading.Event()
+    searches = []
+
+    def slow_search(view, budget):
+        searches.append(view)
+        started.set()
+        release.wait(5)
+        return {'side': 'L', 'row': 0, 'score': 1, 'depth': 1}
+
+    monkeypatch.setattr(service, '_search', slow_search)
+    view = GameView(ALMOST_WON, 3, 'C')
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(service.hint(view, 1000))) for _ in range(5)]
+    threads[0].start()
+    started.wait(5)
+    for t in threads[1:]:
+        t.start()
+    release.set()
+    for t in threads:
+        t.join()
+    assert len(searches) == 1
+    assert len(results) == 5 and all(r is results[0] for r in results)
+
+
+def test_requests_of_a_larger_budget_dont_wait_for_a_smaller_search(monkeypatch):
+    service = HintService()
+    started = threading.Event()
+    release = threading.Event()
+    budgets = []
+
+    def search(view, budget):
+        budgets.append(budget)
+        if budget == 1000:
+            started.set()
+            release.wait(5)
+        return {'side': 'L', 'row': 0, 'score': 1, 'depth': budget}
+
+    monkeypatch.setattr(service, '_search', search)
+    view = GameView(ALMOST_WON, 3, 'C')
+    thread = threading.Thread(target=service.hint, args=(view, 1000))
+    thread.start()
+    started.wait(5)
+    assert service.hint(view, 2000)['depth'] == 2000
+    release.set()
+    thread.join()
+    assert budgets == [1000, 2000]
+    # The result of the larger budget is kept
+    assert service.hint(view, 1500)['depth'] == 2000
+    assert service._searches == {}
+
+
+def test_failed_search_is_raised_to_waiting_requests(monkeypatch):
+    service = HintService()
+
+    def failing_search(view, budget):
+        raise RuntimeError()
+
+    monkeypatch.setattr(service, '_search', failing_search)
+    with pytest.raises(RuntimeError):
+        service.hint(GameView(ALMOST_WON, 3, 'C'), 1000)
+    assert service._searches == {}
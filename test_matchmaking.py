@@ -0,0 +1,93 @@
+import threading
+
+from connection_handler import GameConnectionHandler
+from matchmaking import Matchmaker
+
+
+class FakeDBHandler:
+    def __init__(self):
+        self.batches = []
+
+    def manage_games(self, games):
+        self.batches.append([g.id for g in games])
+
+
+def test_waiting_players_are_paired_in_a_single_batch():
+    db = FakeDBHandler()
+    matchmaker = Matchmaker(GameConnectionHandler(), db)
+    tickets = [matchmaker.request_match() for _ in range(5)]
+    assert matchmaker.pair_waiting() == 2
+    assert len(db.batches) == 1
+    assert tickets[0].wait(0) == tickets[1].wait(0)
+    assert tickets[2].wait(0) == tickets[3].wait(0)
+    assert tickets[0].game_id != tickets[2].game_id
+    # The last player keeps waiting
+    assert tickets[4].wait(0) is None
+
+
+def test_cancelled_players_are_not_paired():
+    matchmaker = Matchmaker(GameConnectionHandler(), FakeDBHandler())
+    t1 = matchmaker.request_match()
+    t2 = matchmaker.request_match()
+    t3 = matchmaker.request_match()
+    assert matchmaker.cancel(t2)
+    matchmaker.pair_waiting()
+    assert t1.game_id is not None
+    assert t1.game_id == t3.game_id
+    assert not matchmaker.cancel(t1)
+
+
+def test_games_are_taken_from_the_pool():
+    gch = GameConnectionHandler(pool_size=2)
+    gch.prewarm()
+    pooled = list(gch._pool)
+    matchmaker = Matchmaker(gch, FakeDBHandler())
+    tickets = [matchmaker.request_match() for _ in range(2)]
+    matchmaker.pair_waiting()
+    assert tickets[0].game_id == pooled[0].id
+    assert gch.has_game(pooled[0].id)
+
+
+def test_games_of_a_failed_batch_are_removed():
+    class FailingDBHandler:
+        def manage_games(self, games):
+            raise IOError()
+
+    gch = GameConnectionHandler()
+    matchmaker = Matchmaker(gch, FailingDBHandler())
+    tickets = [matchmaker.request_match() for _ in range(2)]
+    try:
+        matchmaker.pair_waiting()
+    except IOError:
+        pass
+    assert gch.games == {}
+    assert tickets[0].wait(0) is None
+
+
+def test_players_can_request_and_cancel_while_games_are_inserted():
+    class SlowDBHandler:
+        def __init__(self):
+            self.started = threading.Event()
+            self.release = threading.Event()
+
+        def manage_games(self, games):
+            self.started.set()
+            self.release.wait(5)
+
+    db = SlowDBHandler()
+    gch = GameConnectionHandler()
+    matchmaker = Matchmaker(gch, db)
+    (t1, t2) = [matchmaker.request_match() for _ in range(2)]
+    pairing = threading.Thread(target=matchmaker.pair_waiting)
+    pairing.start()
+    db.started.wait(5)
+    # Answered while the batch is being inserted
+    t3 = matchmaker.request_match()
+    assert matchmaker.cancel(t2)
+    db.release.set()
+    pairing.join()
+    assert t1.game_id is None and t2.game_id is None
+    assert gch.games == {}
+    # The partner of the cancelled player is paired with the next one
+    assert matchmaker.pair_waiting() == 1
+    assert t1.game_id == t3.game_id
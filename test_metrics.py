@@ -0,0 +1,62 @@
+import threading
+
+import pytest
+
+from metrics import Registry, _Metric, counter, gauge, histogram
+
+
+def test_counter_adds_increments_of_every_thread():
+    registry = Registry()
+    c = counter('test_total', 'Test', registry=registry)
+
+    def increment():
+        for _ in range(1000):
+            c.inc()
+
+    threads = [threading.Thread(target=increment) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    c.inc()
+    # Cells of finished threads are folded when the threads exit, without a collection
+    assert len(c._cells._cells) == 1
+    assert c.value() == 4001
+
+
+def test_labelled_counter_exposes_each_child():
+    registry = Registry()
+    c = counter('invalid_total', 'Invalid moves', ['reason'], registry=registry)
+    c.labels('wrong_turn').inc()
+    c.labels('row_full').inc(2)
+    text = registry.expose()
+    assert 'invalid_total{reason="wrong_turn"} 1\n' in text
+    assert 'invalid_total{reason="row_full"} 2\n' in text
+
+
+def test_histogram_exposes_cumulative_buckets():
+    registry = Registry()
+    h = histogram('latency_seconds', 'Latency', buckets=(0.1, 1), registry=registry)
+    for v in (0.05, 0.1, 0.5, 5):
+        h.observe(v)
+    text = registry.expose()
+    assert 'latency_seconds_bucket{le="0.1"} 2\n' in text
+    assert 'latency_seconds_bucket{le="1"} 3\n' in text
+    assert 'latency_seconds_bucket{le="+Inf"} 4\n' in text
+    assert 'latency_seconds_count 4\n' in text
+
+
+def test_gauge_with_function_is_computed_on_collection():
+    registry = Registry()
+    values = [1, 2]
+    gauge('games', 'Games', registry=registry).set_function(lambda: len(values))
+    values.append(3)
+    assert 'games 3\n' in registry.expose()
+
+
+def test_metrics_implement_their_samples():
+    class Incomplete(_Metric):
+        type = 'untyped'
+
+    with pytest.raises(TypeError):
+        Incomplete('incomplete', 'Incomplete')
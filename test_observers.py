@@ -0,0 +1,98 @@
+import threading
+
+from events import PiecePlaced
+from metrics import REGISTRY
+from observers import ObserverQueue
+from sidestacker import SideStacker
+
+
+def new_sidestacker_game():
+    ss = SideStacker('abc')
+    ss.connect('a')
+    ss.connect('b')
+    first = 'a' if ss.players['a'][0] == ss.player_turn else 'b'
+    return ss, first, 'b' if first == 'a' else 'a'
+
+
+def test_queued_observer_receives_events_in_order_from_its_worker():
+    (ss, first, second) = new_sidestacker_game()
+    queue = ObserverQueue('test')
+    received = []
+    ss.add_observer(lambda ev: received.append((ev.turn, threading.current_thread().name)), (PiecePlaced,), queue)
+    ss.place_piece(first, 0, 'L')
+    ss.place_piece(second, 1, 'L')
+    queue.close()
+    queue.join(5)
+    assert received == [(0, 'observer-test'), (1, 'observer-test')]
+
+
+def test_slow_queued_observer_doesnt_delay_the_move():
+    (ss, first, _) = new_sidestacker_game()
+    queue = ObserverQueue('test')
+    release = threading.Event()
+    ss.add_observer(lambda ev: release.wait(5), (PiecePlaced,), queue)
+    ss.place_piece(first, 0, 'L')
+    assert ss.turn == 1
+    release.set()
+    queue.close()
+    queue.join(5)
+
+
+def test_failing_observer_doesnt_stop_the_others():
+    (ss, first, _) = new_sidestacker_game()
+    received = []
+
+    def failing_observer(ev):
+        raise RuntimeError()
+
+    ss.add_observer(failing_observer, (PiecePlaced,))
+    ss.add_observer(received.append, (PiecePlaced,))
+    ss.place_piece(first, 0, 'L')
+    assert len(received) == 1
+    assert 'observer_errors_total{observer="sync"}' in REGISTRY.expose()
+
+
+def test_queue_lag_and_depth_are_exposed():
+    (ss, first, _) = new_sidestacker_game()
+    queue = ObserverQueue('test_metrics')
+    ss.add_observer(lambda ev: None, (PiecePlaced,), queue)
+    ss.place_piece(first, 0, 'L')
+    queue.close()
+    queue.join(5)
+    exposed = REGISTRY.expose()
+    assert 'observer_lag_seconds_count{observer="test_metrics"} 1' in exposed
+    assert 'observer_queue_depth{observer="test_metrics"} 0' in exposed
+
+
+def full_queue(overflow):
+    queue = ObserverQueue('test', maxsize=2, overflow=overflow)
+    started = threading.Event()
+    release = threading.Event()
+    received = []
+
+    def slow_observer(ev):
+        started.set()
+        release.wait(5)
+        received.append(ev)
+
+    queue.put(slow_observer, 0)
+    started.wait(5)
+    # The worker is busy with the first event, the queue holds two more
+    for ev in range(1, 5):
+        queue.put(slow_observer, ev)
+    assert queue.qsize() == (4 if overflow == 'spill' else 2)
+    release.set()
+    queue.close()
+    queue.join(5)
+    return received
+
+
+def test_full_queue_keeps_the_events_over_its_size():
+    overflows = REGISTRY.metrics['observer_overflows_total'].labels('test')
+    before = overflows.value()
+    assert full_queue('spill') == [0, 1, 2, 3, 4]
+    assert overflows.value() - before == 2
+
+
+def test_full_queue_with_drop_policy_loses_the_events_over_its_size():
+    assert full_queue('drop') == [0, 1, 2]
@@ -0,0 +1,52 @@
+import threading
+
+from profiling import sample_stacks, collapsed, start_trace, stop_trace, TRACES
+from sidestacker import SideStacker
+
+
+def test_sample_stacks_captures_other_threads():
+    stop = threading.Event()
+
+    def busy_function():
+        while not stop.is_set():
+            pass
+
+    t = threading.Thread(target=busy_function, name='busy')
+    t.start()
+    try:
+        stacks = sample_stacks(0.05, 0.001)
+    finally:
+        stop.set()
+        t.join()
+    assert any(s.startswith('busy;') and 'busy_function' in s for s in stacks)
+    assert collapsed(stacks).endswith('\n')
+
+
+def test_trace_records_notifications_of_traced_game_only():
+    traced = SideStacker('traced')
+    other = SideStacker('other')
+    for ss in (traced, other):
+        ss.add_observer(lambda ev: None)
+
+    start_trace('traced')
+    try:
+        traced.connect('abc')
+        other.connect('abc')
+    finally:
+        trace = stop_trace('traced')
+
+    assert 'traced' not in TRACES
+    assert [s[0] for s in trace.spans] == ['notify', 'notify']
+    assert trace.spans[0][1].startswith('PlayerConnected -> ')
+
+
+def test_trace_drops_spans_over_limit():
+    ss = SideStacker('limited')
+    ss.add_observer(lambda ev: None)
+    start_trace('limited', max_spans=1)
+    try:
+        ss.connect('abc')
+    finally:
+        trace = stop_trace('limited')
+    assert len(trace.spans) == 1
+    assert trace.dropped == 1
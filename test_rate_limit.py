@@ -0,0 +1,62 @@
+from rate_limit import TokenBucket, RateLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_bucket_allows_burst_then_throttles():
+    bucket = TokenBucket(1, 3, FakeClock())
+    assert all(bucket.consume() for _ in range(3))
+    assert not bucket.consume()
+
+
+def test_bucket_refills_over_time():
+    clock = FakeClock()
+    bucket = TokenBucket(2, 2, clock)
+    bucket.consume(2)
+    assert bucket.wait_time() == 0.5
+    clock.now = 0.5
+    assert bucket.consume()
+    assert not bucket.consume()
+
+
+def test_bucket_doesnt_refill_over_burst():
+    clock = FakeClock()
+    bucket = TokenBucket(1, 2, clock)
+    clock.now = 100
+    bucket.consume(2)
+    assert not bucket.consume()
+
+
+def test_rate_limiter_throttles_each_key():
+    limiter = RateLimiter(0.001, 1)
+    assert limiter.consume('1.1.1.1')
+    assert not limiter.consume('1.1.1.1')
+    assert limiter.consume('2.2.2.2')
+
+
+def test_rate_limiter_memory_is_bounded_by_max_keys():
+    limiter = RateLimiter(0.001, 1, max_keys=10)
+    for i in range(1000):
+        limiter.consume(str(i))
+        limiter.consume(str(i))
+    assert len(limiter.buckets) == 10
+
+
+def test_rate_limiter_evicts_least_recently_used_keys():
+    limiter = RateLimiter(1, 1, max_keys=2)
+    for key in ('a', 'b', 'c'):
+        limiter.consume(key)
+    assert list(limiter.buckets) == ['b', 'c']
+
+
+def test_rate_limiter_wait_time_of_throttled_key():
+    limiter = RateLimiter(2, 1)
+    assert limiter.wait_time('1.1.1.1') == 0
+    limiter.consume('1.1.1.1')
+    assert 0 < limiter.wait_time('1.1.1.1') <= 0.5
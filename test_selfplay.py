@@ -0,0 +1,22 @@
+from collections import Counter
+
+import pytest
+
+from selfplay import play_games, win_rates
+
+
+def test_play_games_reports_every_game():
+    result = play_games(20, ['greedy', 'random'], seed=0, record_moves=True)
+    assert sum(result['wins'].values()) == 20
+    assert result['moves'] == len(result['move_times'])
+    assert len(result['records']) == 20
+    for (_, winner, moves) in result['records']:
+        assert winner in ('X', 'C', 'tie')
+        assert [m[3] for m in moves] == list(range(len(moves)))
+
+
+def test_wins_of_the_same_strategy_are_counted_by_seat():
+    result = play_games(20, ['greedy', 'greedy'], seed=0)
+    assert all(seat is None or seat[0] in ('first', 'second') for seat in result['wins'])
+    rates = win_rates(Counter(result['wins']), 20)
+    assert rates['draw'] + sum(rates['first'].values()) + sum(rates['second'].values()) == pytest.approx(1)
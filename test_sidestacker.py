@@ -1,6 +1,7 @@
+import threading
 from itertools import repeat
 
-from events import PiecePlacedError
+from events import GameOver, PiecePlaced, PiecePlacedError, PlayerConnected, SideStackerEvent
 from sidestacker import SideStacker, get_next_free_position, check_range, evaluate_move
 
 
@@ -44,6 +45,13 @@ def test_player_deleted_after_disconnect():
     assert len(ss.players) == 0
 
 
+def test_other_player_wins_after_disconnect():
+    (ss, first_turn_player, second_turn_player) = new_sidestacker_game()
+    ss.disconnect(first_turn_player[0])
+    assert ss.is_over
+    assert ss.winner == second_turn_player[1]
+
+
 # Place piece
 
 def test_place_piece_adds_piece_to_board():
@@ -127,6 +135,168 @@ def test_place_piece_without_two_players_should_notify():
     assert isinstance(notification, PiecePlacedError)
     assert notification.detail == 'There should be two players to start the game'
 
+def test_place_piece_outside_the_board_notifies_an_error():
+    (ss, first_turn_player, _) = new_sidestacker_game()
+    errors = []
+    ss.add_observer(errors.append, (PiecePlacedError,))
+    for (row, side) in ((-1, 'L'), (7, 'R'), (0, 'X'), (None, 'L'), ('0', 'L')):
+        ss.place_piece(first_turn_player[0], row, side)
+    assert [ev.detail for ev in errors] == ['The row should be between 0 and 6 and the side L or R'] * 5
+    assert ss.turn == 0
+    assert ss.board == [[None] * 7 for _ in range(7)]
+
+# Snapshots and history
+
+def test_version_changes_after_placing_a_piece():
+    (ss, first_turn_player, _) = new_sidestacker_game()
+    snapshot = ss.snapshot()
+    assert ss.snapshot() is snapshot
+    ss.place_piece(first_turn_player[0], 0, 'L')
+    assert ss.snapshot()['version'] == snapshot['version'] + 1
+    assert ss.snapshot()['board'][0][0] == first_turn_player[1]
+
+
+def test_snapshot_waits_for_the_move_being_made():
+    (ss, first_turn_player, _) = new_sidestacker_game()
+    snapshots = []
+    reader = threading.Thread(target=lambda: snapshots.append(ss.snapshot()))
+    with ss._lock:
+        # Halfway through a move, as seen by another thread
+        ss.version += 1
+        reader.start()
+        reader.join(0.05)
+        assert reader.is_alive()
+        ss.turn += 1
+    reader.join()
+    assert snapshots[0]['turn'] == 1
+    assert ss.snapshot() is snapshots[0]
+
+
+def test_events_since_returns_pieces_placed_after_turn():
+    (ss, first_turn_player, second_turn_player) = new_sidestacker_game()
+    ss.place_piece(first_turn_player[0], 0, 'L')
+    ss.place_piece(second_turn_player[0], 1, 'L')
+    ss.place_piece(first_turn_player[0], 2, 'L')
+    assert [ev.turn for ev in ss.events_since(0)] == [1, 2]
+    assert ss.events_since(2) == []
+
+
+def test_events_since_returns_none_when_history_is_exhausted():
+    ss = SideStacker(history_size=1)
+    ss.connect('abc')
+    ss.connect('xyz')
+    for row in range(3):
+        player_id = next(p for (p, (piece, _)) in ss.players.items() if piece == ss.player_turn)
+        ss.place_piece(player_id, row, 'L')
+    assert ss.events_since(0) is None
+    assert len(ss.events_since(1)) == 1
+
+
+def test_view_is_cached_until_the_state_changes():
+    (ss, first_turn_player, _) = new_sidestacker_game()
+    view = ss.view()
+    assert ss.view() is view
+    ss.place_piece(first_turn_player[0], 0, 'L')
+    assert ss.view() is not view
+    assert ss.view().board[0][0] == first_turn_player[1]
+    assert view.board[0][0] is None
+
+
+def test_view_play_returns_a_new_view():
+    (ss, first_turn_player, _) = new_sidestacker_game()
+    view = ss.view()
+    played = view.play(0, 'R')
+    assert played.board[0][6] == first_turn_player[1]
+    assert played.turn == view.turn + 1
+    assert played.player_turn != view.player_turn
+    assert ('R', 0, 5) in played.legal_moves
+    assert view.board[0][6] is None
+    assert ('R', 0, 6) in view.legal_moves
+
+
+def test_view_key_after_play_matches_the_key_of_the_position():
+    (ss, first_turn_player, second_turn_player) = new_sidestacker_game()
+    played = ss.view().play(0, 'L').play(3, 'R')
+    ss.place_piece(first_turn_player[0], 0, 'L')
+    ss.place_piece(second_turn_player[0], 3, 'R')
+    assert played.key == ss.view().key
+    assert played.key != ss.view().play(1, 'L').key
+
+
+def test_filling_the_board_without_four_in_a_row_is_a_tie():
+    (ss, first_turn_player, _) = new_sidestacker_game()
+    # Pairs of columns alternate pieces on every row, so there are never four in a row
+    ss.board = [['X' if (c // 2 + r) % 2 == 0 else 'C' for c in range(7)] for r in range(7)]
+    ss.board[0][6] = None
+    ss.turn = 7 * 7 - 1
+    game_overs = []
+    ss.add_observer(game_overs.append, (GameOver,))
+    ss.place_piece(first_turn_player[0], 0, 'R')
+    assert ss.is_over
+    assert ss.winner is None
+    assert [ev.winner for ev in game_overs] == [None]
+
+
+# Notifications
+
+def test_events_raised_by_observers_are_delivered_in_order():
+    (ss, first_turn_player, second_turn_player) = new_sidestacker_game()
+    received = {'first': [], 'second': []}
+
+    def first_observer(ev):
+        received['first'].append(ev.turn)
+        if ev.turn == 0:
+            ss.place_piece(second_turn_player[0], 1, 'L')
+
+    ss.add_observer(first_observer)
+    ss.add_observer(lambda ev: received['second'].append(ev.turn))
+    ss.place_piece(first_turn_player[0], 0, 'L')
+    assert received['first'] == [0, 1]
+    assert received['second'] == [0, 1]
+
+
+def test_events_of_other_types_reach_the_observers_of_their_base_types():
+    class Chat(SideStackerEvent):
+        __slots__ = ('message',)
+
+        def __init__(self, game_id, message):
+            super().__init__(game_id)
+            self.message = message
+
+    (ss, _, _) = new_sidestacker_game()
+    received = []
+    ss.add_observer(received.append, (SideStackerEvent,))
+    # Nobody observes Chat itself
+    ss.notify(Chat(ss.id, 'hi'))
+    assert [ev.message for ev in received] == ['hi']
+
+
+def test_concurrent_connections_notify_every_event():
+    ss = SideStacker()
+    connected = []
+    ss.add_observer(lambda ev: connected.append(ev.player_id), (PlayerConnected,))
+    threads = [threading.Thread(target=ss.connect, args=(player_id,)) for player_id in ('abc', 'xyz')]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(connected) == ['abc', 'xyz']
+
+
+def test_observers_only_receive_the_subscribed_event_types():
+    (ss, first_turn_player, _) = new_sidestacker_game()
+    received = []
+    ss.add_observer(received.append, (PiecePlaced,))
+    ss.place_piece(first_turn_player[0], 0, 'L')
+    ss.place_piece(first_turn_player[0], 0, 'L')
+    assert [type(ev) for ev in received] == [PiecePlaced]
+
+
+def test_events_have_no_instance_dict():
+    ev = PiecePlaced('abc', 'X', 0, 'L', 0)
+    assert not hasattr(ev, '__dict__')
+
+
 # Evaluation with move
 
 def test_winning_horizontal_stack_should_win():
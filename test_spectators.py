@@ -0,0 +1,101 @@
+import threading
+
+from spectators import SpectatorChannel
+
+
+def new_channel(capacity=4):
+    return SpectatorChannel(lambda: 'snapshot', capacity)
+
+
+def test_spectator_joins_with_snapshot_then_receives_messages():
+    channel = new_channel()
+    viewer = channel.subscribe()
+    channel.publish('a')
+    channel.publish('b')
+    assert viewer.next_message(0) == 'snapshot'
+    assert viewer.next_message(0) == 'a'
+    assert viewer.next_message(0) == 'b'
+    assert viewer.next_message(0) is None
+    assert not viewer.closed
+
+
+def test_spectator_doesnt_receive_messages_before_joining():
+    channel = new_channel()
+    channel.publish('a')
+    viewer = channel.subscribe()
+    channel.publish('b')
+    assert viewer.next_message(0) == 'snapshot'
+    assert viewer.next_message(0) == 'b'
+
+
+def test_slow_spectator_with_drop_policy_loses_oldest_messages():
+    channel = new_channel(capacity=2)
+    viewer = channel.subscribe('drop')
+    viewer.next_message(0)
+    for m in 'abcd':
+        channel.publish(m)
+    assert viewer.next_message(0) == 'c'
+    assert viewer.next_message(0) == 'd'
+    assert viewer.overflows == 1
+
+
+def test_slow_spectator_with_coalesce_policy_receives_snapshot():
+    channel = new_channel(capacity=2)
+    viewer = channel.subscribe('coalesce')
+    viewer.next_message(0)
+    for m in 'abc':
+        channel.publish(m)
+    assert viewer.next_message(0) == 'snapshot'
+    channel.publish('d')
+    assert viewer.next_message(0) == 'd'
+
+
+def test_snapshot_is_taken_when_subscribing():
+    state = ['joined']
+    channel = SpectatorChannel(lambda: state[-1], 4)
+    viewer = channel.subscribe()
+    state.append('moved')
+    channel.publish('move')
+    assert viewer.next_message(0) == 'joined'
+    assert viewer.next_message(0) == 'move'
+
+
+def test_snapshots_are_taken_with_the_lock_of_the_publishers():
+    lock = threading.RLock()
+    held = []
+
+    def snapshot():
+        held.append((lock._is_owned(), channel._cond._is_owned()))
+        return 'snapshot'
+
+    channel = SpectatorChannel(snapshot, 2, lock)
+    viewer = channel.subscribe('coalesce')
+    viewer.next_message(0)
+    for m in 'abc':
+        with lock:
+            channel.publish(m)
+    assert viewer.next_message(0) == 'snapshot'
+    assert held == [(True, False), (True, False)]
+
+
+def test_slow_spectator_with_disconnect_policy_is_closed():
+    channel = new_channel(capacity=2)
+    viewer = channel.subscribe('disconnect')
+    viewer.next_message(0)
+    for m in 'abc':
+        channel.publish(m)
+    assert viewer.next_message(0) is None
+    assert viewer.closed
+    assert viewer not in channel.viewers
+
+
+def test_spectator_drains_pending_messages_before_closing():
+    channel = new_channel()
+    viewer = channel.subscribe()
+    viewer.next_message(0)
+    channel.publish('game_over')
+    channel.close()
+    assert viewer.next_message(0) == 'game_over'
+    assert not viewer.closed
+    assert viewer.next_message(0) is None
+    assert viewer.closed
@@ -0,0 +1,86 @@
+from flask import Flask, request
+
+from static_assets import AssetManifest, IMMUTABLE_CACHE_CONTROL, REVALIDATE_CACHE_CONTROL
+
+app = Flask(__name__)
+
+
+def build_directory(tmp_path):
+    (tmp_path / 'static' / 'js').mkdir(parents=True)
+    (tmp_path / 'index.html').write_text('<html>' + 'x' * 2000 + '</html>')
+    (tmp_path / 'static' / 'js' / 'main.abc123.js').write_text('console.log(1);' * 200)
+    (tmp_path / 'big.bin').write_bytes(b'\0' * 100)
+    return str(tmp_path)
+
+
+def test_manifest_indexes_every_file(tmp_path):
+    manifest = AssetManifest(build_directory(tmp_path))
+    assert set(manifest.assets) == {'index.html', 'static/js/main.abc123.js', 'big.bin'}
+    assert manifest.get('index.html').cache_control == REVALIDATE_CACHE_CONTROL
+    assert manifest.get('static/js/main.abc123.js').cache_control == IMMUTABLE_CACHE_CONTROL
+
+
+def test_compressed_variant_is_served_when_accepted(tmp_path):
+    manifest = AssetManifest(build_directory(tmp_path))
+    asset = manifest.get('static/js/main.abc123.js')
+    with app.test_request_context(headers={'Accept-Encoding': 'gzip'}):
+        response = manifest.response(asset, request)
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.get_data() == asset.gzip
+    with app.test_request_context():
+        response = manifest.response(asset, request)
+    assert 'Content-Encoding' not in response.headers
+    assert response.get_data() == asset.data
+
+
+def test_responses_of_compressed_files_vary_on_accept_encoding(tmp_path):
+    manifest = AssetManifest(build_directory(tmp_path))
+    asset = manifest.get('static/js/main.abc123.js')
+    for headers in ({'Accept-Encoding': 'gzip'}, {}, {'If-None-Match': '"%s"' % asset.etag}):
+        with app.test_request_context(headers=headers):
+            response = manifest.response(asset, request)
+        assert 'Accept-Encoding' in response.vary
+    with app.test_request_context():
+        response = manifest.response(manifest.get('big.bin'), request)
+    assert 'Accept-Encoding' not in response.vary
+
+
+def test_matching_etag_returns_not_modified(tmp_path):
+    manifest = AssetManifest(build_directory(tmp_path))
+    asset = manifest.get('index.html')
+    with app.test_request_context(headers={'If-None-Match': '"%s"' % asset.etag, 'Accept-Encoding': 'gzip'}):
+        response = manifest.response(asset, request)
+    assert response.status_code == 304
+    assert response.get_data() == b''
+    assert 'Accept-Encoding' in response.vary
+
+
+def test_gzip_variant_has_its_own_etag(tmp_path):
+    manifest = AssetManifest(build_directory(tmp_path))
+    asset = manifest.get('static/js/main.abc123.js')
+    with app.test_request_context(headers={'Accept-Encoding': 'gzip'}):
+        gzip_etag = manifest.response(asset, request).headers['ETag']
+    with app.test_request_context():
+        identity_etag = manifest.response(asset, request).headers['ETag']
+    assert gzip_etag == '"%s-gz"' % asset.etag
+    assert identity_etag == '"%s"' % asset.etag
+    for (etag, headers) in ((gzip_etag, {}), (identity_etag, {'Accept-Encoding': 'gzip'})):
+        with app.test_request_context(headers=dict(headers, **{'If-None-Match': etag})):
+            response = manifest.response(asset, request)
+        assert response.status_code == 304
+        assert response.headers['ETag'] == etag
+
+
+def test_large_files_are_not_kept_in_memory(tmp_path):
+    manifest = AssetManifest(build_directory(tmp_path), max_memory_size=50)
+    asset = manifest.get('big.bin')
+    assert asset.data is None
+    with app.test_request_context():
+        response = manifest.response(asset, request)
+        response.direct_passthrough = False
+        assert response.get_data() == b'\0' * 100
+    assert response.headers['ETag'] == '"%s"' % asset.etag
+
+
+def test_missing_directory_has_no_assets(tmp_path):
+    assert AssetManifest(str(tmp_path / 'missing')).assets == {}